@@ -1,18 +1,26 @@
 import streamlit as st
-import pandas as pd
-import logic
-import io
-import streamlit_authenticator as stauth
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-from datetime import datetime, timedelta
-import time
-import requests 
-import uuid
-import base64
-import streamlit.components.v1 as components
+import warmup
+with warmup.startup_import_profile("앱 시작"):
+    import logic
+    import curriculum
+    import artifacts
+    import shared_state
+    import log_store
+    from page_loader import PageLoader
+    import io
+    import streamlit_authenticator as stauth
+    # gspread / oauth2client는 로그인 화면의 users 시트 읽기(fetch_all_users)에서 처음 불러오고,
+    # googleapiclient(드라이브)는 로그인 이후에만 필요하므로 쓰는 함수 안에서 불러옴
+    from datetime import datetime, timedelta
+    import time
+    import threading
+    from contextlib import contextmanager
+    import http_client
+    import uuid
+    import base64
+    import streamlit.components.v1 as components
+
+warmup.mark("모듈 불러오기")
 
 # -----------------------------------------------------------------------------
 # 1. 페이지 설정
@@ -134,38 +142,103 @@ try:
     else:
         TOSS_CLIENT_KEY = "TEST"; TOSS_SECRET_KEY = "TEST"
 
+    # 같은 호스트 안의 로컬 경로만 지정 (네트워크 볼륨 불가, shared_state.py 참고)
+    if "shared_state" in st.secrets:
+        shared_state.configure(st.secrets["shared_state"]["path"])
+
 except Exception as e:
     st.sidebar.error(f"시크릿 로드 오류: {e}")
 
+cache_stats = logic.generation_cache.stats()
+st.sidebar.caption(f"♻️ 생성 캐시: 적중 {cache_stats['hits']} · 합류 {cache_stats['coalesced']} · 신규 {cache_stats['misses']}")
+host_rows = http_client.host_report()
+if host_rows:
+    with st.sidebar.expander("🌐 외부 호출"):
+        st.dataframe(host_rows, hide_index=True)
+usage_rows = logic.usage_stats.report()
+if usage_rows:
+    with st.sidebar.expander("📈 모델 사용량"):
+        st.dataframe(usage_rows, hide_index=True)
+boot_rows = warmup.report()
+if boot_rows:
+    with st.sidebar.expander("🚀 시작 준비"):
+        st.dataframe(boot_rows, hide_index=True)
+        st.caption("모듈별 불러오기 시간 (처음 불러올 때, 하위 모듈 포함)")
+        st.dataframe(warmup.import_report(), hide_index=True)
+
 CS_LINK = "https://open.kakao.com/o/sample" 
 
 # 세션 초기화
 if "file_history" not in st.session_state: st.session_state["file_history"] = []
-if "processed_list" not in st.session_state: st.session_state["processed_list"] = []
 if "alert_msg" not in st.session_state: st.session_state["alert_msg"] = None
 
+# 상호작용(전체 실행 / 조각 재실행)당 구글 시트/드라이브 HTTP 요청 수
+call_stats = st.session_state.get("call_stats", {})
+if call_stats:
+    with st.sidebar.expander("🔁 실행당 구글 API 요청"):
+        st.dataframe([{"범위": k, "실행 수": v[0], "HTTP 요청": v[1], "실행당 평균": round(v[1] / max(v[0], 1), 2)} for k, v in call_stats.items()], hide_index=True)
+
 # -----------------------------------------------------------------------------
 # 2. 구글 연동 함수
 # -----------------------------------------------------------------------------
+# 인증 정보와 클라이언트는 프로세스 안의 모든 세션이 같이 씀 (워밍업 스레드가 미리 만들어 둠)
+@st.cache_resource(show_spinner=False)
 def get_gcp_creds():
     try:
         if "gcp_service_account" not in st.secrets: return None
         key_dict = st.secrets["gcp_service_account"]
         scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+        from oauth2client.service_account import ServiceAccountCredentials
         return ServiceAccountCredentials.from_json_keyfile_dict(key_dict, scope)
     except: return None
 
-def get_db_client():
+@st.cache_resource(show_spinner=False)
+def _db_client():
     creds = get_gcp_creds()
     if not creds: return None
-    return gspread.authorize(creds)
-
-def get_drive_service():
+    import gspread
+    client = gspread.authorize(creds)
+    # 클라이언트 생성이 아니라 실제 HTTP 요청(open/worksheet/find/get_all_values...)마다 집계
+    session = getattr(client, "session", None) or client.http_client.session
+    session.hooks["response"].append(lambda response, *args, **kwargs: count_external_call())
+    return client
+
+@st.cache_resource(show_spinner=False)
+def _drive_service():
     creds = get_gcp_creds()
     if not creds: return None
-    return build('drive', 'v3', credentials=creds)
+    import httplib2
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+    # 서비스 객체(API 정의)는 공유하고, 스레드 안전하지 않은 httplib2 연결만 요청마다 새로 만듦
+    def counted_http():
+        http = creds.authorize(httplib2.Http())
+        send = http.request
+        def request(*args, **kwargs):
+            # 조각 업로드/다운로드는 조각마다 한 번씩 집계
+            count_external_call()
+            return send(*args, **kwargs)
+        http.request = request
+        return http
+    def request_builder(http, *args, **kwargs):
+        return HttpRequest(counted_http(), *args, **kwargs)
+    return build('drive', 'v3', http=counted_http(), requestBuilder=request_builder)
+
+def get_db_client():
+    return _db_client()
 
-def upload_to_drive(file_obj, filename):
+def get_drive_service():
+    return _drive_service()
+
+def warm_google_clients():
+    """워밍업 스레드용: 공유 클라이언트를 만들고 액세스 토큰/연결까지 미리 받아 둠"""
+    client = _db_client()
+    if client is None: return
+    client.open("math_app_db")
+    _drive_service()
+    get_gcp_creds().get_access_token()
+
+def upload_to_drive(handle):
     if not DRIVE_FOLDER_ID:
         st.session_state["alert_msg"] = "❌ 설정 오류: Secrets에 folder_id가 비어있습니다."
         return None
@@ -175,28 +248,37 @@ def upload_to_drive(file_obj, filename):
             st.session_state["alert_msg"] = "❌ 인증 오류: 구글 드라이브 서비스 연결 실패"
             return None
         
-        file_metadata = {'name': filename, 'parents': [DRIVE_FOLDER_ID]}
-        media = MediaIoBaseUpload(file_obj, mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        file_metadata = {'name': handle['name'], 'parents': [DRIVE_FOLDER_ID]}
+        # 디스크 파일을 mmap으로 열어 조각 단위로 업로드 (메모리 사본 없음)
+        from googleapiclient.http import MediaIoBaseUpload
+        view = artifacts.open_mmap(handle)
+        try:
+            media = MediaIoBaseUpload(view, mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document', chunksize=1024*1024, resumable=True)
+            file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        finally:
+            view.close()
         return file.get('id')
     except Exception as e: 
         st.session_state["alert_msg"] = f"❌ 업로드 실패: {str(e)}\n\n💡 힌트: `{ai_email}` 계정이 폴더에 [편집자]로 초대되었나요?"
         return None
 
-def download_from_drive(file_id):
+def download_from_drive(file_id, filename):
+    handle = artifacts.new_handle(filename)
     try:
         service = get_drive_service()
         request = service.files().get_media(fileId=file_id)
-        file = io.BytesIO()
-        downloader = MediaIoBaseDownload(file, request)
-        done = False
-        while done is False: status, done = downloader.next_chunk()
-        file.seek(0)
-        return file
+        from googleapiclient.http import MediaIoBaseDownload
+        with open(artifacts.path_of(handle), "wb") as file:
+            downloader = MediaIoBaseDownload(file, request)
+            done = False
+            while done is False: status, done = downloader.next_chunk()
+        return handle
     except Exception as e:
+        artifacts.discard(handle)
         st.error(f"❌ 다운로드 실패: {str(e)}")
         return None
 
+@st.cache_data(ttl=300, show_spinner=False)
 def fetch_all_users():
     client = get_db_client()
     if not client: return []
@@ -213,14 +295,17 @@ def register_user(new_username, new_name, new_password):
         if new_username in existing_users: return "DUPLICATE"
         hashed_pw = stauth.Hasher([new_password]).generate()[0]
         sheet.append_row([new_username, hashed_pw, new_name, 5])
+        fetch_all_users.clear()
         return "SUCCESS"
     except Exception as e: return str(e)
 
-def get_user_credits(username, force_refresh=False):
-    if "cached_credits" in st.session_state and not force_refresh:
-        return st.session_state["cached_credits"]
+def get_user_credits(username, force_refresh=False, client=None):
+    # 프로세스/세션 간 공유 캐시 (잔액이 바뀌면 add_credit에서 바로 갱신)
+    if not force_refresh:
+        cached = shared_state.get_cached_credits(username)
+        if cached is not None: return cached
     
-    client = get_db_client()
+    client = client or get_db_client()
     if not client: return 0
     try:
         sheet = client.open("math_app_db").worksheet("users")
@@ -229,37 +314,69 @@ def get_user_credits(username, force_refresh=False):
             val = sheet.cell(cell.row, 4).value
             try: credits = int(val)
             except: credits = 0
-            st.session_state["cached_credits"] = credits
+            shared_state.set_cached_credits(username, credits)
             return credits
         else: return 0
     except Exception as e:
-        return st.session_state.get("cached_credits", 0)
+        stale = shared_state.get_cached_credits(username, max_age=None)
+        return stale if stale is not None else 0
 
 def add_credit(username, amount):
+    """시트에 기록했으면 True, 실패(또는 결과 불명)면 False"""
     client = get_db_client()
-    if not client: return
+    if not client: return False
     try:
         sheet = client.open("math_app_db").worksheet("users")
         cell = sheet.find(username)
         current = int(sheet.cell(cell.row, 4).value)
         new_amount = current + amount
         sheet.update_cell(cell.row, 4, new_amount)
-        st.session_state["cached_credits"] = new_amount
-    except: pass
+        shared_state.set_cached_credits(username, new_amount)
+        return True
+    except Exception as e:
+        print(f"이용권 기록 실패: {e}")
+        # 시트 기록 결과를 모르면 캐시를 비워 다음 조회 때 시트에서 다시 읽음
+        shared_state.invalidate_credits(username)
+        return False
 
 def deduct_credit(username, amount):
-    add_credit(username, -amount)
+    return add_credit(username, -amount)
+
+class DriveLogArchiver:
+    """log_store가 지난 달 로그를 드라이브에 보관/조회할 때 사용"""
+
+    def upload(self, name, data):
+        if not DRIVE_FOLDER_ID: return None
+        service = get_drive_service()
+        if not service: return None
+        from googleapiclient.http import MediaIoBaseUpload
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype='application/gzip')
+        return service.files().create(body={'name': name, 'parents': [DRIVE_FOLDER_ID]}, media_body=media, fields='id').execute().get('id')
+
+    def download(self, file_id):
+        from googleapiclient.http import MediaIoBaseDownload
+        service = get_drive_service()
+        buf = io.BytesIO()
+        downloader = MediaIoBaseDownload(buf, service.files().get_media(fileId=file_id))
+        done = False
+        while done is False: status, done = downloader.next_chunk()
+        return buf.getvalue()
+
+log_archiver = DriveLogArchiver()
+
+def compact_logs():
+    client = get_db_client()
+    if client: log_store.maybe_compact(client.open("math_app_db"), log_archiver)
 
 def log_activity(username, type_or_school, detail_or_grade, extra1="", extra2="", extra3="", file_id=""):
     client = get_db_client()
     if not client: return
     try:
-        sheet = client.open("math_app_db").worksheet("logs")
-        kst_now = datetime.now() + timedelta(hours=9)
-        now_str = kst_now.strftime("%Y-%m-%d %H:%M:%S")
+        now_str = log_store.kst_now().strftime("%Y-%m-%d %H:%M:%S")
         
         row = [now_str, username, type_or_school, detail_or_grade, extra1, extra2, extra3, file_id]
-        sheet.append_row(row)
+        # 이번 달 파티션에만 추가 + 사용자 요약 갱신
+        log_store.append_log(client.open("math_app_db"), row, log_archiver)
     except Exception as e:
         print(f"로그 저장 실패: {e}")
 
@@ -270,12 +387,21 @@ def format_kor_date(date_str):
     except:
         return date_str
 
-def get_user_history_processed(username):
-    client = get_db_client()
-    if not client: return []
+def read_log_values(client=None):
+    """시트에 남은 로그만 읽음: 평소에는 이번 달 시트 하나 (보관된 지난 달 로그는 보관함에서 요청할 때만)"""
+    client = client or get_db_client()
+    if not client: return None
+    return log_store.read_live_rows(client.open("math_app_db"))
+
+def read_log_values_with_archive(username, client=None):
+    client = client or get_db_client()
+    if not client: return None
+    return log_store.read_all_rows(client.open("math_app_db"), log_archiver, username)
+
+def get_user_history_processed(username, records=None):
     try:
-        sheet = client.open("math_app_db").worksheet("logs")
-        records = sheet.get_all_values()
+        if records is None: records = read_log_values()
+        if records is None: return []
         
         my_logs = []
         if len(records) < 2: return []
@@ -319,156 +445,155 @@ def get_user_history_processed(username):
     except Exception as e:
         return []
 
-def check_daily_free_used(username):
-    client = get_db_client()
-    if not client: return True 
+def kst_today():
+    return (datetime.now() + timedelta(hours=9)).strftime("%Y-%m-%d")
+
+def read_user_summary(username, client=None):
+    """사용자별 누적 건수/마지막 무료 사용일. 기록이 없는 사용자는 {}, 시트 연결 실패는 None"""
+    client = client or get_db_client()
+    if not client: return None
+    return log_store.read_summary(client.open("math_app_db"), username) or {}
+
+def check_daily_free_used(username, summary=None):
+    # 로그를 훑지 않고 요약 테이블의 마지막 무료 사용일만 확인
+    today_str = kst_today()
+    if shared_state.daily_free_used(username, today_str): return True
     try:
-        sheet = client.open("math_app_db").worksheet("logs")
-        records = sheet.get_all_values()
-        today_str = (datetime.now() + timedelta(hours=9)).strftime("%Y-%m-%d")
-        for row in reversed(records):
-            if len(row) > 4:
-                if row[0].startswith(today_str) and row[1] == username and row[4] == "DAILY_FREE":
-                    return True
-        return False
+        if summary is None: summary = read_user_summary(username)
+        if summary is None: return True
+        used = summary.get("last_free_date") == today_str
+        if used: shared_state.mark_daily_free(username, today_str)
+        return used
     except: return True
 
 def confirm_toss_payment(payment_key, order_id, amount):
     url = "https://api.tosspayments.com/v1/payments/confirm"
     secret_key_str = f"{TOSS_SECRET_KEY}:"
     encoded_key = base64.b64encode(secret_key_str.encode("utf-8")).decode("utf-8")
-    headers = {"Authorization": f"Basic {encoded_key}", "Content-Type": "application/json"}
+    # 같은 결제를 다시 보내도 토스에서 한 번만 승인되도록 멱등키 지정
+    headers = {"Authorization": f"Basic {encoded_key}", "Content-Type": "application/json", "Idempotency-Key": payment_key}
     data = {"paymentKey": payment_key, "orderId": order_id, "amount": amount}
     try:
-        res = requests.post(url, json=data, headers=headers)
+        res = http_client.post(url, json=data, headers=headers, timeout=(http_client.CONNECT_TIMEOUT, 30))
         return res.json()
     except Exception as e: return {"error": str(e)}
 
-@st.cache_data(ttl=3600) 
-def load_curriculum_optimized():
-    try: 
-        df = pd.read_excel("통합_수학_커리큘럼.xlsx")
-        df['grade'] = df['grade'].astype(str).str.replace('학년', '')
-        df['search_label'] = df['school'] + " " + df['grade'] + "학년 - " + df['unit']
-        return df
-    except: 
-        return pd.DataFrame({"school":["초등"],"grade":["3"],"unit":["샘플"],"search_label":["초등 3학년 - 샘플 데이터"]})
-
 # -----------------------------------------------------------------------------
-# 로그인
+# 3. 화면 조각 (fragment: 조각 안의 위젯을 누르면 그 조각만 다시 실행)
 # -----------------------------------------------------------------------------
-users_data = fetch_all_users()
-if not users_data:
-    st.sidebar.error("🚨 DB 연결 실패: users 시트를 읽을 수 없습니다.")
-    names, usernames, hashed_passwords = ["관리자"], ["admin"], ["$2b$12$EXAMPLE..."]
-else:
-    names, usernames, hashed_passwords = [], [], []
-    for user in users_data:
-        usernames.append(str(user['username']))
-        names.append(str(user['name']))
-        hashed_passwords.append(str(user['password']))
-
-authenticator = stauth.Authenticate(names, usernames, hashed_passwords, 'mk_cookie', 'mk_key', cookie_expiry_days=30)
-
-if 'authentication_status' not in st.session_state or st.session_state['authentication_status'] is None:
-    tab1, tab2 = st.tabs(["🔑 로그인", "📝 회원가입"])
-    with tab1:
-        name, authentication_status, username = authenticator.login('main')
-        if authentication_status == False: st.error('로그인 실패')
-    with tab2:
-        with st.form("signup"):
-            uid = st.text_input("ID"); uname = st.text_input("이름"); upw = st.text_input("PW", type="password")
-            st.caption("✨ 가입 즉시 무료 이용권 5장을 드립니다!")
-            if st.form_submit_button("가입"):
-                res = register_user(uid, uname, upw)
-                if res=="SUCCESS": st.success("가입 완료! 로그인 해주세요.")
-                else: st.error(res)
-else:
-    username = st.session_state['username']
-    name = st.session_state['name']
-    authentication_status = True
-
-if authentication_status:
-    
-    if "credits_refreshed" not in st.session_state:
-        get_user_credits(username, force_refresh=True)
-        st.session_state["credits_refreshed"] = True
-
-    curr_credits = get_user_credits(username)
-    
-    query_params = st.query_params
-    my_app_url = "https://math-maker-try.streamlit.app" 
-
-    if "paymentKey" in query_params and "orderId" in query_params:
-        st.markdown("<h2 style='text-align:center;'>💸 결제 처리 결과</h2>", unsafe_allow_html=True)
-        payment_key = query_params["paymentKey"]
-        order_id = query_params["orderId"]
-        amount = int(query_params["amount"])
-        
-        if payment_key in st.session_state["processed_list"]:
-            st.info("✅ 이미 완료된 결제입니다.")
-            st.markdown(f'<br><a href="{my_app_url}" target="_self" style="text-decoration:none;"><button style="width:100%; background-color:#2563EB; color:white; padding:15px; border:none; border-radius:12px; font-size:1.1rem; font-weight:bold; cursor:pointer;">🏠 홈으로 돌아가기</button></a>', unsafe_allow_html=True)
-            st.stop()
-        else:
-            with st.spinner("승인 처리 중..."):
-                result = confirm_toss_payment(payment_key, order_id, amount)
-            
-            if "status" in result and result["status"] == "DONE":
-                if amount == 1000: added_credits = 20
-                elif amount == 5000: added_credits = 110
-                elif amount == 10000: added_credits = 240
-                elif amount == 30000: added_credits = 750
-                else: added_credits = 0
-                
-                add_credit(username, added_credits)
-                log_activity(username, "결제완료", f"{amount}원", "충전", f"+{added_credits}장", "")
-                st.session_state["processed_list"].append(payment_key)
-                st.balloons()
-                st.success(f"🎉 결제 성공! {added_credits}장이 충전되었습니다.")
-                st.markdown(f"""
-                    <div style="background-color:#F0FDF4; padding:20px; border-radius:10px; border:1px solid #BBF7D0; text-align:center; margin-bottom:20px;">
-                        <h3 style="color:#166534; margin:0;">✅ 충전 완료</h3>
-                        <p style="color:#15803D; margin-top:5px;">이제 바로 문제를 만드실 수 있습니다.</p>
-                    </div>
-                    <a href="{my_app_url}" target="_self" style="text-decoration:none;">
-                        <button style="width:100%; background-color:#2563EB; color:white; padding:20px; border:none; border-radius:15px; font-size:1.2rem; font-weight:bold; cursor:pointer;">🏠 홈으로 돌아가기 (클릭)</button>
-                    </a>
-                """, unsafe_allow_html=True)
-                st.stop()
-            else:
-                st.error(f"결제 실패: {result.get('message', '오류')}")
-                st.stop()
-
-    col_t1, col_t2 = st.columns([6, 4])
-    with col_t2:
-        c1, c2, c3 = st.columns([1.5, 1.5, 1])
-        with c1: st.markdown(f"""<a href="{CS_LINK}" target="_blank" class="cs-btn"><button>💬 문의하기</button></a>""", unsafe_allow_html=True)
-        with c2: st.markdown(f'<div style="text-align:right; padding-top:8px;">👤 <b>{name}</b> | 🎫 <b>{curr_credits}</b></div>', unsafe_allow_html=True)
-        with c3: authenticator.logout('로그아웃', 'main')
-
-    col_l, col_c, col_r = st.columns([1, 2, 1])
-    with col_c:
-        try: 
-            st.image("logo.png", width=400) 
-        except: 
-            st.markdown("<h1 style='text-align:center; font-size: 3.5rem; color: #2563EB;'>🧞‍♂️ 지니매쓰</h1>", unsafe_allow_html=True)
-    st.write("")
-
-    tab_make, tab_store, tab_history = st.tabs(["📄 학습지 만들기", "🏪 충전소", "📂 내 보관함"])
-    
-    if st.session_state["alert_msg"]:
-        st.error(st.session_state["alert_msg"])
-
-    with tab_make:
-        df = load_curriculum_optimized()
+def begin_full_run():
+    st.session_state["run_scope"] = "전체"
+    st.session_state.setdefault("call_stats", {}).setdefault("전체", [0, 0])[0] += 1
+
+def end_full_run():
+    st.session_state["run_scope"] = None
+
+@contextmanager
+def fragment_scope(scope):
+    """전체 실행 중이면 '전체'에 합산하고, 조각 단독 재실행이면 해당 조각 이름으로 외부 호출 수를 집계"""
+    inline = st.session_state.get("run_scope") == "전체"
+    if not inline:
+        st.session_state["run_scope"] = scope
+        st.session_state.setdefault("call_stats", {}).setdefault(scope, [0, 0])[0] += 1
+        # 조각 단독 재실행은 지난 실행의 결과를 쓰지 않도록 새 로더로 시작
+        st.session_state["page_loader"] = None
+    try: yield
+    finally:
+        if not inline: st.session_state["run_scope"] = None
+
+_call_stats_lock = threading.Lock()
+
+def count_external_call():
+    # 페이지 로더 작업 스레드에서도 불리므로 잠금 안에서 더함 (세션 컨텍스트가 없는 워밍업 스레드는 무시)
+    try:
+        scope = st.session_state.get("run_scope") or "전체"
+        with _call_stats_lock:
+            st.session_state.setdefault("call_stats", {}).setdefault(scope, [0, 0])[1] += 1
+    except Exception: pass
+
+def new_page_loader(username):
+    # 요약 행은 무료 여부 확인과 보관함 누적 건수가 같이 쓰므로 한 번 그리는 동안 한 번만 읽음
+    include_archive = st.session_state.get("history_include_archive", False)
+    # 시트 클라이언트(인증 토큰 포함)도 한 번만 만들어 같이 씀
+    def client(loader): return loader.read_once("db", get_db_client)
+    def summary(loader): return loader.read_once("summary", lambda: read_user_summary(username, client(loader)))
+
+    def credits(loader):
+        cached = shared_state.get_cached_credits(username)
+        if cached is not None: return cached
+        return get_user_credits(username, force_refresh=True, client=client(loader))
+
+    def daily_free(loader):
+        try: return check_daily_free_used(username, summary(loader))
+        except Exception: return True
+
+    def user_summary(loader):
+        try: return summary(loader) or {}
+        except Exception: return {}
+
+    def history(loader):
+        try:
+            if include_archive: return get_user_history_processed(username, read_log_values_with_archive(username, client(loader)))
+            return get_user_history_processed(username, read_log_values(client(loader)))
+        except Exception: return []
+
+    return PageLoader({"credits": credits, "daily_free": daily_free, "history": history, "summary": user_summary})
+
+def prefetch_page_data(username):
+    """전체 실행 시작 시 화면에 필요한 데이터를 한꺼번에 동시 요청 (이미 캐시된 것은 제외)"""
+    needs = ["credits"]
+    cached = st.session_state.get("daily_free_checked")
+    if not (cached and cached[0] == kst_today()): needs.append("daily_free")
+    if st.session_state.get("history_cache") is None: needs += ["history", "summary"]
+    st.session_state["page_loader"] = new_page_loader(username).prefetch(*needs)
+
+def page_data(username, name):
+    # 전체 실행 중이면 미리 요청해 둔 결과를, 조각 단독 재실행이면 그 조각의 로더에서 가져옴
+    loader = st.session_state.get("page_loader")
+    if loader is None:
+        loader = st.session_state["page_loader"] = new_page_loader(username)
+    return loader.get(name)
+
+def daily_free_used_cached(username):
+    # 조각이 다시 실행될 때마다 요약 시트를 다시 읽지 않도록 같은 날에는 결과 재사용
+    today_str = kst_today()
+    cached = st.session_state.get("daily_free_checked")
+    if cached and cached[0] == today_str: return cached[1]
+    used = page_data(username, "daily_free")
+    st.session_state["daily_free_checked"] = (today_str, used)
+    return used
+
+def history_cached(username):
+    if st.session_state.get("history_cache") is None:
+        st.session_state["history_cache"] = page_data(username, "history")
+        st.session_state["summary_cache"] = page_data(username, "summary")
+    return st.session_state["history_cache"]
+
+@st.fragment
+def render_header(username, name):
+    with fragment_scope("상단"):
+        curr_credits = page_data(username, "credits")
+        st.markdown(f'<div style="text-align:right; padding-top:8px;">👤 <b>{name}</b> | 🎫 <b>{curr_credits}</b></div>', unsafe_allow_html=True)
+
+@st.fragment
+def render_generation_panel(username):
+    with fragment_scope("학습지 만들기"):
+        if st.session_state["alert_msg"]:
+            st.error(st.session_state["alert_msg"])
+        curr_credits = page_data(username, "credits")
+        store = curriculum.load_store()
         with st.container():
             st.markdown("""<div class="control-card"><div class="card-header">🔍 학습 내용 선택</div>""", unsafe_allow_html=True)
-            all_options = df['search_label'].unique()
-            selected_full_label = st.selectbox("원하는 학년이나 단원을 검색하세요", all_options, label_visibility="collapsed")
-            try:
-                part1, part2 = selected_full_label.split(" - ")
-                p_school = part1.split(" ")[0]; p_grade = part1.split(" ")[1].replace("학년", ""); p_topic = part2
-            except: p_school, p_grade, p_topic = "초등", "3", "덧셈"
+            query = st.text_input("학년이나 단원 검색", placeholder="예: 초등 3 분수, 중2 일차함수", label_visibility="collapsed")
+            options = store.search(query)
+            if not options:
+                st.caption("검색 결과가 없어 전체 목록을 보여드립니다.")
+                options = store.search("")
+            elif len(options) >= curriculum.MAX_RESULTS:
+                st.caption(f"검색 결과가 많아 {curriculum.MAX_RESULTS}개만 보여드립니다. 검색어를 더 자세히 입력해주세요.")
+            selected_unit = st.selectbox("원하는 학년이나 단원을 선택하세요", options, format_func=lambda u: u.label, label_visibility="collapsed")
+            p_school, p_grade, p_topic = selected_unit.school, selected_unit.grade, selected_unit.unit
+            selected_full_label = selected_unit.label
             st.markdown("</div>", unsafe_allow_html=True)
 
         with st.container():
@@ -479,18 +604,24 @@ if authentication_status:
                 st.write(f"**[{selected_full_label}]** 내용으로 **난이도 '하' 4문제**를 무료로 만들어 드립니다!")
                 st.caption("※ 무료 버전은 개인 학습용입니다. (배포 금지)")
             with col_d2:
-                is_used_today = check_daily_free_used(username)
+                is_used_today = daily_free_used_cached(username)
                 if "last_generated_free" in st.session_state:
-                    st.success("✅ 생성 완료!")
-                    # 메인 탭에서는 버튼 크게 (CSS .big-download-btn)
-                    st.markdown('<div class="big-download-btn">', unsafe_allow_html=True)
-                    st.download_button("📥 다운로드 (무료)", data=st.session_state["last_generated_free"]["data"], file_name=st.session_state["last_generated_free"]["name"], mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", key="dl_free_imm")
-                    st.markdown('</div>', unsafe_allow_html=True)
-                    
+                    handle = st.session_state["last_generated_free"]
+                    if artifacts.exists(handle):
+                        st.success("✅ 생성 완료!")
+                        # 메인 탭에서는 버튼 크게 (CSS .big-download-btn)
+                        st.markdown('<div class="big-download-btn">', unsafe_allow_html=True)
+                        with artifacts.open_stream(handle) as f:
+                            st.download_button("📥 다운로드 (무료)", data=f, file_name=handle["name"], mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", key="dl_free_imm")
+                        st.markdown('</div>', unsafe_allow_html=True)
+                    else:
+                        st.info("⏰ 임시 파일이 만료되었습니다. 보관함에서 받아주세요.")
+
                     if st.button("닫기 (새로고침)"): 
+                        artifacts.discard(handle)
                         del st.session_state["last_generated_free"]
                         st.session_state["alert_msg"] = None 
-                        st.rerun()
+                        st.rerun(scope="fragment")
                 elif is_used_today:
                     st.button("✅ 오늘 완료", disabled=True, key="daily_done")
                 else:
@@ -498,14 +629,22 @@ if authentication_status:
                         st.session_state["alert_msg"] = None 
                         with st.spinner(f"🎁 {p_topic} 무료 생성 중..."):
                             try:
-                                docx_obj = logic.generate_math_docx(p_school, p_grade, p_topic, "하", 4, is_commercial=False)
-                                docx_bytes = docx_obj.getvalue()
                                 file_name = f"지니매쓰_무료_{p_school}{p_grade}_{p_topic}.docx"
-                                
-                                file_id = upload_to_drive(io.BytesIO(docx_bytes), file_name)
-                                log_activity(username, "무료생성", selected_full_label, "DAILY_FREE", "4문제", "0장", file_id=file_id)
-                                st.session_state["last_generated_free"] = {"data": docx_bytes, "name": file_name}
-                                st.rerun()
+                                handle = artifacts.new_handle(file_name)
+                                _, delivered = logic.generate_math_docx(p_school, p_grade, p_topic, "하", 4, is_commercial=False, username=username, daily_free=True, out=artifacts.path_of(handle))
+                                if not delivered:
+                                    # 오늘 무료 사용으로 치지 않음
+                                    artifacts.discard(handle)
+                                    st.session_state["alert_msg"] = "문제를 만들지 못했습니다. 잠시 후 다시 시도해주세요."
+                                    st.rerun(scope="fragment")
+
+                                file_id = upload_to_drive(handle)
+                                log_activity(username, "무료생성", selected_full_label, "DAILY_FREE", f"{delivered}문제", "0장", file_id=file_id)
+                                shared_state.mark_daily_free(username, kst_today())
+                                st.session_state["daily_free_checked"] = (kst_today(), True)
+                                st.session_state["history_cache"] = None
+                                st.session_state["last_generated_free"] = handle
+                                st.rerun(scope="fragment")
                             except Exception as e: 
                                 st.session_state["alert_msg"] = f"오류 발생: {e}"
                                 st.rerun()
@@ -528,7 +667,7 @@ if authentication_status:
 
         base_cost = prob_count // 4
         final_cost = base_cost * 8 if is_commercial else base_cost
-        
+
         b_col1, b_col2, b_col3 = st.columns([1, 2, 1])
         with b_col2:
             if curr_credits < final_cost:
@@ -538,56 +677,71 @@ if authentication_status:
                 l_label = "💎 상업용" if is_commercial else "👤 개인용"
                 btn_text = f"🚀 {l_label} 생성하기 ({final_cost}장 차감)"
                 btn_disabled = False
-            
+
             st.markdown("""<style>div.stButton > button { width: 100%; padding: 16px 0; font-size: 1.1rem; border-radius: 12px; }</style>""", unsafe_allow_html=True)
-            
+
             if "last_generated_paid" in st.session_state:
-                st.success("✅ 생성 완료!")
-                # 메인 탭에서는 버튼 크게
-                st.markdown('<div class="big-download-btn">', unsafe_allow_html=True)
-                st.download_button("📥 다운로드 (파일 저장)", data=st.session_state["last_generated_paid"]["data"], file_name=st.session_state["last_generated_paid"]["name"], mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", key="dl_paid_imm")
-                st.markdown('</div>', unsafe_allow_html=True)
-                
+                handle = st.session_state["last_generated_paid"]
+                if artifacts.exists(handle):
+                    st.success("✅ 생성 완료!")
+                    # 메인 탭에서는 버튼 크게
+                    st.markdown('<div class="big-download-btn">', unsafe_allow_html=True)
+                    with artifacts.open_stream(handle) as f:
+                        st.download_button("📥 다운로드 (파일 저장)", data=f, file_name=handle["name"], mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document", key="dl_paid_imm")
+                    st.markdown('</div>', unsafe_allow_html=True)
+                else:
+                    st.info("⏰ 임시 파일이 만료되었습니다. 보관함에서 받아주세요.")
+
                 if st.button("계속 만들기"): 
+                    artifacts.discard(handle)
                     del st.session_state["last_generated_paid"]
                     st.session_state["alert_msg"] = None
-                    st.rerun()
+                    st.rerun(scope="fragment")
             elif st.button(btn_text, disabled=btn_disabled, key="gen_btn"):
                 st.session_state["alert_msg"] = None
                 with st.spinner(f"💡 {selected_full_label} 문제 생성 중..."):
                     try:
-                        docx_obj = logic.generate_math_docx(p_school, p_grade, p_topic, difficulty, prob_count, is_commercial=is_commercial)
-                        docx_bytes = docx_obj.getvalue()
-                        deduct_credit(username, final_cost)
-                        
                         license_log = "COMMERCIAL" if is_commercial else "PERSONAL"
                         file_name = f"지니매쓰_{license_log}_{p_school}{p_grade}_{p_topic}.docx"
-                        
-                        file_id = upload_to_drive(io.BytesIO(docx_bytes), file_name)
-                        log_activity(username, "문제생성", selected_full_label, p_topic, f"{prob_count}문제", f"-{final_cost}장 ({license_log})", file_id=file_id)
-                        st.session_state["last_generated_paid"] = {"data": docx_bytes, "name": file_name}
+                        handle = artifacts.new_handle(file_name)
+                        _, delivered = logic.generate_math_docx(p_school, p_grade, p_topic, difficulty, prob_count, is_commercial=is_commercial, username=username, out=artifacts.path_of(handle))
+                        if not delivered:
+                            artifacts.discard(handle)
+                            st.session_state["alert_msg"] = "문제를 만들지 못했습니다. 이용권은 차감되지 않았습니다."
+                            st.rerun(scope="fragment")
+                        # 끝까지 채우지 못한 문항이 있으면 담긴 문제 수만큼만 차감 (내림)
+                        charged = final_cost * delivered // prob_count
+                        if charged: deduct_credit(username, charged)
+
+                        file_id = upload_to_drive(handle)
+                        log_activity(username, "문제생성", selected_full_label, p_topic, f"{delivered}문제", f"-{charged}장 ({license_log})", file_id=file_id)
+                        st.session_state["history_cache"] = None
+                        st.session_state["last_generated_paid"] = handle
+                        # 이용권이 바뀌었으므로 상단 잔액까지 전체 갱신
                         st.rerun()
                     except Exception as e: 
                         st.session_state["alert_msg"] = f"오류: {e}"
                         st.rerun()
 
-    with tab_store:
+@st.fragment
+def render_store(username, name):
+    with fragment_scope("충전소"):
         try:
             st.markdown("<br><h3 style='text-align:center;'>🏪 필요한 만큼 충전해서 사용하세요</h3><br>", unsafe_allow_html=True)
-            
+
             row1_col1, row1_col2 = st.columns(2)
             row2_col1, row2_col2 = st.columns(2)
-            
+
             with row1_col1:
                 st.markdown("""<div class="product-card"><div style="font-size:1.2rem; font-weight:bold;">🎫 알뜰형 (20장)</div><div style="font-size:1.5rem; font-weight:800; color:#2563EB;">1,000원</div><div style="color:#666; font-size:0.9rem; margin-top:5px;">장당 50원</div></div>""", unsafe_allow_html=True)
                 order_id_1000 = f"{username}_{uuid.uuid4().hex}"
                 components.html(f"""<style>button{{width:95%;padding:15px;background:#2563EB;color:white;border:none;border-radius:10px;font-size:16px;font-weight:bold;cursor:pointer;}}button:hover{{background:#1D4ED8;}}</style><button onclick="pay(1000, '{order_id_1000}', '지니매쓰 20장')">1,000원 결제</button><script src="https://js.tosspayments.com/v1/payment"></script><script>var clientKey='{TOSS_CLIENT_KEY}';var tossPayments=TossPayments(clientKey);function pay(amt, oid, name){{tossPayments.requestPayment('카드',{{amount:amt,orderId:oid,orderName:name,customerName:'{name}',successUrl:'{my_app_url}',failUrl:'{my_app_url}'}}).catch(e=>{{if(e.code!=='USER_CANCEL')alert('오류:'+e.message);}});}}</script>""", height=70)
-            
+
             with row1_col2:
                 st.markdown("""<div class="product-card"><div style="font-size:1.2rem; font-weight:bold;">👑 실속형 (110장)</div><div style="font-size:1.5rem; font-weight:800; color:#4F46E5;">5,000원</div><div style="color:#666; font-size:0.9rem; margin-top:5px;">장당 45원 (10% 보너스)</div></div>""", unsafe_allow_html=True)
                 order_id_5000 = f"{username}_{uuid.uuid4().hex}"
                 components.html(f"""<style>button{{width:95%;padding:15px;background:#4F46E5;color:white;border:none;border-radius:10px;font-size:16px;font-weight:bold;cursor:pointer;}}button:hover{{background:#4338CA;}}</style><button onclick="pay(5000, '{order_id_5000}', '지니매쓰 110장')">5,000원 결제</button><script src="https://js.tosspayments.com/v1/payment"></script><script>var clientKey='{TOSS_CLIENT_KEY}';var tossPayments=TossPayments(clientKey);function pay(amt, oid, name){{tossPayments.requestPayment('카드',{{amount:amt,orderId:oid,orderName:name,customerName:'{name}',successUrl:'{my_app_url}',failUrl:'{my_app_url}'}}).catch(e=>{{if(e.code!=='USER_CANCEL')alert('오류:'+e.message);}});}}</script>""", height=70)
-            
+
             with row2_col1:
                 st.markdown("""<div class="product-card"><div style="font-size:1.2rem; font-weight:bold;">🔥 인기형 (240장)</div><div style="font-size:1.5rem; font-weight:800; color:#E11D48;">10,000원</div><div style="color:#666; font-size:0.9rem; margin-top:5px;">장당 41원 (20% 보너스)</div></div>""", unsafe_allow_html=True)
                 order_id_10000 = f"{username}_{uuid.uuid4().hex}"
@@ -600,13 +754,29 @@ if authentication_status:
 
         except Exception as e: st.error(f"충전소 로딩 오류: {e}")
 
-    # -------------------------------------------------------------------------
-    # TAB 3: 내 보관함 (최종: 2열 구조 + 제목이 버튼)
-    # -------------------------------------------------------------------------
-    with tab_history:
+# -------------------------------------------------------------------------
+# TAB 3: 내 보관함 (최종: 2열 구조 + 제목이 버튼)
+# -------------------------------------------------------------------------
+@st.fragment
+def render_history(username):
+    with fragment_scope("보관함"):
         st.markdown("<br><h3 style='text-align:center;'>📂 내가 만든 학습지 보관함</h3><br>", unsafe_allow_html=True)
         try:
-            history = get_user_history_processed(username)
+            h_col1, h_col2 = st.columns([8, 1.5])
+            with h_col2:
+                if st.button("🔄 새로고침", key="history_refresh"):
+                    st.session_state["history_cache"] = None
+            if not st.session_state.get("history_include_archive"):
+                with h_col1:
+                    if st.button("📦 지난 달 기록도 불러오기", key="history_archive"):
+                        st.session_state["history_include_archive"] = True
+                        st.session_state["history_cache"] = None
+            history = history_cached(username)
+            totals = st.session_state.get("summary_cache") or {}
+            if totals:
+                st.caption(f"누적 기록: 문제 생성 {totals['generated']}회 · 매일 무료 {totals['daily_free']}회 · 충전 {totals['payments']}회")
+            # 받을 준비가 된 파일은 가장 최근에 누른 하나만 유지 (download_button이 실행마다 파일 전체를 메모리에 올리므로)
+            ready_id, ready_handle = st.session_state.get("history_ready") or (None, None)
             if not history:
                 st.info("📭 보관함이 비어있습니다.")
             else:
@@ -617,34 +787,181 @@ if authentication_status:
                     <div style='flex:8;'>학습 내용 (클릭하여 다운로드)</div>
                 </div>
                 """, unsafe_allow_html=True)
-                
+
                 for item in history:
                     # 행 컨테이너
                     with st.container():
                         c1, c2 = st.columns([1.5, 8])
-                        
+
                         # 1열: 날짜 (텍스트)
                         c1.markdown(f"<div class='date-text'>{item['date']}</div>", unsafe_allow_html=True)
-                        
+
                         # 2열: 학습 내용 자체가 '투명 버튼' (클릭 시 다운로드)
                         with c2:
                             if item['file_id']:
                                 # 버튼이지만 텍스트처럼 보이게 CSS 적용됨
-                                # 키(key)를 유니크하게 설정하여 충돌 방지
-                                if st.download_button(
-                                    label=item['desc'],
-                                    data=download_from_drive(item['file_id']) or b'',
-                                    file_name=f"지니매쓰_{item['date'].replace('.','').replace(':','')}.docx",
-                                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                                    key=f"dl_link_{item['file_id']}_{uuid.uuid4()}"
-                                ):
-                                    pass # 다운로드는 자동 처리됨
+                                # 드라이브 파일은 누른 항목만 받아서 임시 저장소에 보관 (화면 그릴 때마다 전부 받지 않음)
+                                handle = ready_handle if ready_id == item['file_id'] else None
+                                if handle and artifacts.exists(handle):
+                                    with artifacts.open_stream(handle) as f:
+                                        st.download_button(
+                                            label=f"📥 {item['desc']}",
+                                            data=f,
+                                            file_name=handle['name'],
+                                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                                            key=f"dl_link_{item['file_id']}"
+                                        )
+                                elif st.button(item['desc'], key=f"prep_{item['file_id']}"):
+                                    file_name = f"지니매쓰_{item['date'].replace('.','').replace(':','').replace(' ','_')}.docx"
+                                    with st.spinner("파일 준비 중..."):
+                                        handle = download_from_drive(item['file_id'], file_name)
+                                    if handle:
+                                        if ready_handle: artifacts.discard(ready_handle)
+                                        st.session_state["history_ready"] = (item['file_id'], handle)
+                                        st.rerun(scope="fragment")
                             else:
                                 st.caption("파일 없음")
-                        
+
                         # 구분선 (엑셀 라인 느낌)
                         st.markdown("<div style='border-bottom:1px solid #E5E7EB; margin-top:-5px;'></div>", unsafe_allow_html=True)
 
         except Exception as e:
             st.error(f"보관함 오류: {e}")
 
+# -----------------------------------------------------------------------------
+# 로그인
+# -----------------------------------------------------------------------------
+# 프로세스당 한 번: 첫 문제 생성에 필요한 무거운 준비를 로그인 화면 뒤에서 미리 처리
+warmup.start([
+    ("한글 폰트 (matplotlib 폰트 캐시)", logic.get_korean_font),
+    ("그림 렌더러", logic.warm_up_rendering),
+    ("python-docx", lambda: __import__("docx")),
+    ("교육과정 데이터", curriculum.load_store),
+    ("구글 클라이언트", warm_google_clients),
+    # 배포 직후 기존 logs 시트가 요약에 합쳐지기 전에는 무료 사용 여부를 놓칠 수 있으므로 바로 정리
+    ("지난 로그 보관", compact_logs),
+    ("Gemini 모델", logic.init_models),
+])
+
+begin_full_run()
+users_data = fetch_all_users()
+if not users_data:
+    st.sidebar.error("🚨 DB 연결 실패: users 시트를 읽을 수 없습니다.")
+    names, usernames, hashed_passwords = ["관리자"], ["admin"], ["$2b$12$EXAMPLE..."]
+else:
+    names, usernames, hashed_passwords = [], [], []
+    for user in users_data:
+        usernames.append(str(user['username']))
+        names.append(str(user['name']))
+        hashed_passwords.append(str(user['password']))
+
+authenticator = stauth.Authenticate(names, usernames, hashed_passwords, 'mk_cookie', 'mk_key', cookie_expiry_days=30)
+
+if 'authentication_status' not in st.session_state or st.session_state['authentication_status'] is None:
+    tab1, tab2 = st.tabs(["🔑 로그인", "📝 회원가입"])
+    with tab1:
+        name, authentication_status, username = authenticator.login('main')
+        warmup.mark("로그인 화면")
+        if authentication_status == False: st.error('로그인 실패')
+    with tab2:
+        with st.form("signup"):
+            uid = st.text_input("ID"); uname = st.text_input("이름"); upw = st.text_input("PW", type="password")
+            st.caption("✨ 가입 즉시 무료 이용권 5장을 드립니다!")
+            if st.form_submit_button("가입"):
+                res = register_user(uid, uname, upw)
+                if res=="SUCCESS": st.success("가입 완료! 로그인 해주세요.")
+                else: st.error(res)
+else:
+    username = st.session_state['username']
+    name = st.session_state['name']
+    authentication_status = True
+
+if authentication_status:
+    
+    query_params = st.query_params
+    my_app_url = "https://math-maker-try.streamlit.app" 
+
+    if "paymentKey" in query_params and "orderId" in query_params:
+        st.markdown("<h2 style='text-align:center;'>💸 결제 처리 결과</h2>", unsafe_allow_html=True)
+        payment_key = query_params["paymentKey"]
+        order_id = query_params["orderId"]
+        amount = int(query_params["amount"])
+        
+        home_button = f'<br><a href="{my_app_url}" target="_self" style="text-decoration:none;"><button style="width:100%; background-color:#2563EB; color:white; padding:15px; border:none; border-radius:12px; font-size:1.1rem; font-weight:bold; cursor:pointer;">🏠 홈으로 돌아가기</button></a>'
+
+        # 다른 세션/프로세스에서 같은 paymentKey가 다시 들어와도 한 번만 승인·충전
+        if not shared_state.claim_payment(payment_key, username, amount):
+            status = shared_state.payment_status(payment_key)
+            if status == shared_state.PAYMENT_CREDITED:
+                st.info("✅ 이미 완료된 결제입니다.")
+            elif status == shared_state.PAYMENT_CONFIRMED:
+                # 승인 후 충전 결과를 알 수 없는 결제는 자동으로 다시 충전하지 않음
+                st.warning(f"⏳ 결제가 승인되어 충전을 처리하고 있습니다. 잠시 후에도 충전되지 않았다면 고객센터로 문의해주세요. (결제번호: {payment_key})")
+            else:
+                st.warning("⏳ 다른 창에서 처리 중인 결제입니다. 1분 뒤에도 충전되지 않았다면 이 페이지를 새로고침해주세요.")
+            st.markdown(home_button, unsafe_allow_html=True)
+            st.stop()
+        else:
+            with st.spinner("승인 처리 중..."):
+                result = confirm_toss_payment(payment_key, order_id, amount)
+            
+            if "status" in result and result["status"] == "DONE":
+                if amount == 1000: added_credits = 20
+                elif amount == 5000: added_credits = 110
+                elif amount == 10000: added_credits = 240
+                elif amount == 30000: added_credits = 750
+                else: added_credits = 0
+                
+                # 충전 전에 승인 상태부터 남김: 이후 이 결제를 이어받는 세션은 다시 충전하지 않음
+                if not shared_state.confirm_payment(payment_key):
+                    st.info("✅ 다른 창에서 이미 처리된 결제입니다.")
+                    st.markdown(home_button, unsafe_allow_html=True)
+                    st.stop()
+                if not add_credit(username, added_credits):
+                    log_activity(username, "충전실패", f"{amount}원", payment_key, f"+{added_credits}장", "")
+                    st.error(f"결제는 승인되었지만 이용권 충전 기록에 실패했습니다. 고객센터로 문의해주세요. (결제번호: {payment_key})")
+                    st.markdown(home_button, unsafe_allow_html=True)
+                    st.stop()
+                shared_state.credit_payment(payment_key)
+                log_activity(username, "결제완료", f"{amount}원", "충전", f"+{added_credits}장", "")
+                st.balloons()
+                st.success(f"🎉 결제 성공! {added_credits}장이 충전되었습니다.")
+                st.markdown(f"""
+                    <div style="background-color:#F0FDF4; padding:20px; border-radius:10px; border:1px solid #BBF7D0; text-align:center; margin-bottom:20px;">
+                        <h3 style="color:#166534; margin:0;">✅ 충전 완료</h3>
+                        <p style="color:#15803D; margin-top:5px;">이제 바로 문제를 만드실 수 있습니다.</p>
+                    </div>
+                    <a href="{my_app_url}" target="_self" style="text-decoration:none;">
+                        <button style="width:100%; background-color:#2563EB; color:white; padding:20px; border:none; border-radius:15px; font-size:1.2rem; font-weight:bold; cursor:pointer;">🏠 홈으로 돌아가기 (클릭)</button>
+                    </a>
+                """, unsafe_allow_html=True)
+                st.stop()
+            else:
+                shared_state.release_payment(payment_key)
+                st.error(f"결제 실패: {result.get('message', '오류')}")
+                st.stop()
+
+    prefetch_page_data(username)
+
+    col_t1, col_t2 = st.columns([6, 4])
+    with col_t2:
+        c1, c2, c3 = st.columns([1.5, 1.5, 1])
+        with c1: st.markdown(f"""<a href="{CS_LINK}" target="_blank" class="cs-btn"><button>💬 문의하기</button></a>""", unsafe_allow_html=True)
+        with c2: render_header(username, name)
+        with c3: authenticator.logout('로그아웃', 'main')
+
+    col_l, col_c, col_r = st.columns([1, 2, 1])
+    with col_c:
+        try: 
+            st.image("logo.png", width=400) 
+        except: 
+            st.markdown("<h1 style='text-align:center; font-size: 3.5rem; color: #2563EB;'>🧞‍♂️ 지니매쓰</h1>", unsafe_allow_html=True)
+    st.write("")
+
+    tab_make, tab_store, tab_history = st.tabs(["📄 학습지 만들기", "🏪 충전소", "📂 내 보관함"])
+
+    with tab_make: render_generation_panel(username)
+    with tab_store: render_store(username, name)
+    with tab_history: render_history(username)
+
+    end_full_run()
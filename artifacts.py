@@ -0,0 +1,63 @@
+import mmap
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+# -----------------------------------------------------------------------------
+# 1. 생성 파일 임시 저장소 설정
+# -----------------------------------------------------------------------------
+# 세션에는 작은 핸들만 두고, 실제 문서는 디스크에 한 번만 기록
+ARTIFACT_DIR = os.path.join(tempfile.gettempdir(), "genie_math_artifacts")
+ARTIFACT_TTL = 6 * 3600
+CLEANUP_INTERVAL = 300
+
+_lock = threading.Lock()
+_last_cleanup = 0.0
+
+# -----------------------------------------------------------------------------
+# 2. 핸들
+# -----------------------------------------------------------------------------
+def new_handle(filename):
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    cleanup()
+    return {"id": uuid.uuid4().hex, "name": filename}
+
+def path_of(handle):
+    return os.path.join(ARTIFACT_DIR, f"{handle['id']}.docx")
+
+def exists(handle):
+    return bool(handle) and os.path.exists(path_of(handle))
+
+def discard(handle):
+    try: os.remove(path_of(handle))
+    except OSError: pass
+
+# -----------------------------------------------------------------------------
+# 3. 읽기 (복사본 없이 파일에서 바로)
+# -----------------------------------------------------------------------------
+def open_stream(handle):
+    """다운로드 버튼용 파일 객체"""
+    return open(path_of(handle), "rb")
+
+def open_mmap(handle):
+    """업로드용 읽기 전용 mmap (read/seek/tell 지원, 페이지 캐시를 그대로 사용)"""
+    with open(path_of(handle), "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+# -----------------------------------------------------------------------------
+# 4. 만료 파일 정리
+# -----------------------------------------------------------------------------
+def cleanup(now=None):
+    global _last_cleanup
+    now = now or time.time()
+    with _lock:
+        if now - _last_cleanup < CLEANUP_INTERVAL: return
+        _last_cleanup = now
+    try: entries = list(os.scandir(ARTIFACT_DIR))
+    except OSError: return
+    for entry in entries:
+        try:
+            if now - entry.stat().st_mtime > ARTIFACT_TTL: os.remove(entry.path)
+        except OSError: pass
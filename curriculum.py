@@ -0,0 +1,121 @@
+import os
+import pickle
+import threading
+from collections import namedtuple
+
+# -----------------------------------------------------------------------------
+# 1. 커리큘럼 저장소 설정
+# -----------------------------------------------------------------------------
+CURRICULUM_FILE = "통합_수학_커리큘럼.xlsx"
+COMPILED_FILE = ".curriculum_cache.pkl"
+FORMAT_VERSION = 1
+MAX_RESULTS = 200
+
+# 단원 하나 = 구조화된 레코드 (라벨 문자열을 다시 쪼갤 필요 없음)
+Unit = namedtuple("Unit", ["school", "grade", "unit", "label"])
+
+SAMPLE_UNITS = [Unit("초등", "3", "샘플", "초등 3학년 - 샘플 데이터")]
+
+_lock = threading.Lock()
+_store = None
+
+# -----------------------------------------------------------------------------
+# 2. 검색 인덱스 (접두어 + 2-gram)
+# -----------------------------------------------------------------------------
+def _normalize(text):
+    return "".join(str(text).lower().split())
+
+def _search_keys(u):
+    # 학교/학년/단원 각각을 검색 대상으로 ("3", "3학년", "초3" 모두 매칭되도록)
+    return [u.school, u.grade, f"{u.grade}학년", f"{u.school[:1]}{u.grade}", u.unit]
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+class SearchIndex:
+    def __init__(self, units):
+        self.units = units
+        self.haystacks = []
+        self.prefixes = {}   # 1글자 접두어 -> 레코드 번호
+        self.grams = {}      # 2-gram -> 레코드 번호
+        for i, u in enumerate(units):
+            keys = [_normalize(k) for k in _search_keys(u)]
+            self.haystacks.append("|".join(keys))
+            for key in keys:
+                if key: self.prefixes.setdefault(key[0], set()).add(i)
+                for g in _bigrams(key): self.grams.setdefault(g, set()).add(i)
+
+    def _candidates(self, token):
+        if len(token) == 1:
+            return self.prefixes.get(token, set())
+        postings = [self.grams.get(g) for g in _bigrams(token)]
+        if not all(postings): return set()
+        hits = set.intersection(*postings)
+        # 2-gram 교집합은 후보일 뿐이므로 실제 부분 문자열인지 확인
+        return {i for i in hits if token in self.haystacks[i]}
+
+    def search(self, query, limit=MAX_RESULTS):
+        """검색어가 없으면 전체 목록(선택 상자 안에서 입력해 거를 수 있도록), 있으면 최대 limit개"""
+        tokens = [_normalize(t) for t in str(query or "").split()]
+        tokens = [t for t in tokens if t]
+        if not tokens: return list(self.units)
+        result = None
+        for token in sorted(tokens, key=len, reverse=True):
+            hits = self._candidates(token)
+            result = hits if result is None else result & hits
+            if not result: return []
+        return [self.units[i] for i in sorted(result)[:limit]]
+
+# -----------------------------------------------------------------------------
+# 3. 컴파일 (xlsx -> 바이너리)
+# -----------------------------------------------------------------------------
+def _read_units(xlsx_path):
+    import pandas as pd
+    df = pd.read_excel(xlsx_path, dtype=str).fillna("")
+    units, seen = [], set()
+    for school, grade, unit in zip(df['school'], df['grade'], df['unit']):
+        school = school.strip(); grade = grade.replace('학년', '').strip(); unit = unit.strip()
+        if not (school and grade and unit): continue
+        label = f"{school} {grade}학년 - {unit}"
+        if label in seen: continue
+        seen.add(label)
+        units.append(Unit(school, grade, unit, label))
+    return units
+
+def compile_curriculum(xlsx_path=CURRICULUM_FILE, out_path=COMPILED_FILE):
+    mtime = os.stat(xlsx_path).st_mtime_ns
+    index = SearchIndex(_read_units(xlsx_path))
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"version": FORMAT_VERSION, "mtime": mtime, "index": index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, out_path)
+    return mtime, index
+
+def _read_compiled(out_path, mtime):
+    try:
+        with open(out_path, "rb") as f: data = pickle.load(f)
+        if data.get("version") == FORMAT_VERSION and data.get("mtime") == mtime:
+            return data["index"]
+    except Exception: pass
+    return None
+
+def load_store(xlsx_path=CURRICULUM_FILE, out_path=COMPILED_FILE):
+    """xlsx 수정 시각이 바뀐 경우에만 다시 컴파일하고, 그 외에는 메모리/바이너리 캐시 사용"""
+    global _store
+    try: mtime = os.stat(xlsx_path).st_mtime_ns
+    except OSError: mtime = None
+
+    if _store and _store[0] == mtime: return _store[1]
+    with _lock:
+        if _store and _store[0] == mtime: return _store[1]
+        if mtime is None:
+            index = SearchIndex(SAMPLE_UNITS)
+        else:
+            index = _read_compiled(out_path, mtime)
+            if index is None:
+                try: mtime, index = compile_curriculum(xlsx_path, out_path)
+                except Exception as e:
+                    print(f"커리큘럼 컴파일 오류: {e}")
+                    index = SearchIndex(SAMPLE_UNITS)
+        _store = (mtime, index)
+        return index
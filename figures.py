@@ -0,0 +1,202 @@
+import io
+import json
+import math
+from functools import lru_cache
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.patches as patches
+
+# -----------------------------------------------------------------------------
+# 1. 도형 함수 목록
+# -----------------------------------------------------------------------------
+# AI는 Matplotlib 코드를 쓰는 대신 이름 + JSON 인자만 지정 (예: {"type": "clock", "hour": 3, "minute": 30})
+PRIMITIVES = {}
+CATALOG = []
+FONT_PROPS = {"font": None}
+
+class FigureError(ValueError):
+    pass
+
+def primitive(name, signature):
+    def register(func):
+        PRIMITIVES[name] = func
+        CATALOG.append(f'{{"type": "{name}", {signature}}}')
+        return func
+    return register
+
+def catalog_prompt():
+    return "\n".join(f"    - {line}" for line in CATALOG)
+
+# -----------------------------------------------------------------------------
+# 2. 인자 검사
+# -----------------------------------------------------------------------------
+def _num(spec, key, default=None, lo=-1000, hi=1000):
+    value = spec.get(key, default)
+    if value is None: raise FigureError(f"'{key}' 값이 필요합니다.")
+    try: value = float(value)
+    except (TypeError, ValueError): raise FigureError(f"'{key}' 값이 숫자가 아닙니다: {value!r}")
+    if not (lo <= value <= hi): raise FigureError(f"'{key}' 값이 범위({lo}~{hi})를 벗어났습니다.")
+    return value
+
+def _int(spec, key, default=None, lo=0, hi=100):
+    return int(round(_num(spec, key, default, lo, hi)))
+
+def _label(value):
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return str(value)
+
+def _text(ax, x, y, s, **kwargs):
+    ax.text(x, y, s, fontproperties=FONT_PROPS["font"], **kwargs)
+
+MAX_TICKS = 20
+
+def _int_ticks(lo, hi):
+    # 범위가 넓으면 정수 간격을 늘려 눈금을 MAX_TICKS개 이하로 (±1000 범위에서 2001개 방지)
+    step = max(1, math.ceil((hi - lo) / MAX_TICKS))
+    return np.arange(math.ceil(lo / step) * step, math.floor(hi) + 1, step)
+
+# -----------------------------------------------------------------------------
+# 3. 미리 계산한 템플릿 (시계 눈금 등)
+# -----------------------------------------------------------------------------
+_ANGLES = np.deg2rad(90 - np.arange(60) * 6)
+CLOCK_TICKS = [((0.9 if i % 5 == 0 else 0.95) * np.cos(a), (0.9 if i % 5 == 0 else 0.95) * np.sin(a), np.cos(a), np.sin(a)) for i, a in enumerate(_ANGLES)]
+CLOCK_NUMERALS = [(0.78 * np.cos(np.deg2rad(90 - h * 30)), 0.78 * np.sin(np.deg2rad(90 - h * 30)), str(h)) for h in range(1, 13)]
+
+# -----------------------------------------------------------------------------
+# 4. 도형 함수
+# -----------------------------------------------------------------------------
+@primitive("number_line", '"start": 0, "end": 10, "step": 1, "points": [{"x": 3, "label": "A"}]')
+def number_line(ax, spec):
+    start, end = _num(spec, "start", 0), _num(spec, "end", 10)
+    step = _num(spec, "step", 1, lo=1e-6)
+    if end <= start or (end - start) / step > 60: raise FigureError("수직선 범위/간격이 올바르지 않습니다.")
+    ax.annotate("", xy=(end + step * 0.6, 0), xytext=(start - step * 0.6, 0), arrowprops=dict(arrowstyle="<->", lw=1.5))
+    for x in np.arange(start, end + step / 2, step):
+        ax.plot([x, x], [-0.15, 0.15], color="black", lw=1)
+        _text(ax, x, -0.45, _label(round(float(x), 6)), ha="center", va="top", fontsize=9)
+    for p in spec.get("points", []):
+        x = _num(p, "x")
+        ax.plot(x, 0, "o", color="#E11D48", markersize=7, zorder=3)
+        if p.get("label"): _text(ax, x, 0.35, str(p["label"]), ha="center", va="bottom", fontsize=11, color="#E11D48")
+    ax.set_ylim(-1, 1)
+    ax.axis("off")
+
+@primitive("grid", '"rows": 3, "cols": 4, "shaded": [[0, 0], [0, 1]]')
+def grid(ax, spec):
+    rows, cols = _int(spec, "rows", lo=1, hi=30), _int(spec, "cols", lo=1, hi=30)
+    shaded = {(int(r), int(c)) for r, c in spec.get("shaded", [])}
+    for r in range(rows):
+        for c in range(cols):
+            color = "#93C5FD" if (r, c) in shaded else "white"
+            ax.add_patch(patches.Rectangle((c, rows - 1 - r), 1, 1, facecolor=color, edgecolor="black", lw=1))
+    ax.set_xlim(-0.2, cols + 0.2); ax.set_ylim(-0.2, rows + 0.2)
+    ax.axis("off")
+
+@primitive("polygon", '"points": [[0, 0], [4, 0], [0, 3]], "vertex_labels": ["A", "B", "C"], "side_labels": ["4cm", "5cm", "3cm"]')
+def polygon(ax, spec):
+    points = spec.get("points")
+    if not points and spec.get("sides"):
+        n = _int(spec, "sides", lo=3, hi=12)
+        points = [(math.cos(2 * math.pi * i / n + math.pi / 2), math.sin(2 * math.pi * i / n + math.pi / 2)) for i in range(n)]
+    if not points or len(points) < 3 or len(points) > 12: raise FigureError("다각형 꼭짓점은 3~12개여야 합니다.")
+    pts = np.array([[float(x), float(y)] for x, y in points])
+    ax.add_patch(patches.Polygon(pts, closed=True, facecolor="#E0F2FE", edgecolor="black", lw=1.5))
+    center = pts.mean(axis=0)
+    span = max(np.ptp(pts[:, 0]), np.ptp(pts[:, 1]), 1e-6)
+    for label, (x, y) in zip(spec.get("vertex_labels", []), pts):
+        d = np.array([x, y]) - center
+        d = d / (np.linalg.norm(d) or 1) * span * 0.08
+        _text(ax, x + d[0], y + d[1], str(label), ha="center", va="center", fontsize=11, fontweight="bold")
+    for i, label in enumerate(spec.get("side_labels", [])[:len(pts)]):
+        if not label: continue
+        mid = (pts[i] + pts[(i + 1) % len(pts)]) / 2
+        d = mid - center
+        d = d / (np.linalg.norm(d) or 1) * span * 0.08
+        _text(ax, mid[0] + d[0], mid[1] + d[1], str(label), ha="center", va="center", fontsize=10, color="#1D4ED8")
+    pad = span * 0.2
+    ax.set_xlim(pts[:, 0].min() - pad, pts[:, 0].max() + pad)
+    ax.set_ylim(pts[:, 1].min() - pad, pts[:, 1].max() + pad)
+    ax.axis("off")
+
+@primitive("coordinate_plane", '"xmin": -5, "xmax": 5, "ymin": -5, "ymax": 5, "points": [{"x": 1, "y": 2, "label": "P"}], "lines": [{"slope": 2, "intercept": 1}]')
+def coordinate_plane(ax, spec):
+    xmin, xmax = _num(spec, "xmin", -5), _num(spec, "xmax", 5)
+    ymin, ymax = _num(spec, "ymin", -5), _num(spec, "ymax", 5)
+    if xmax <= xmin or ymax <= ymin: raise FigureError("좌표평면 범위가 올바르지 않습니다.")
+    ax.grid(True, color="#E5E7EB", lw=0.8)
+    ax.axhline(0, color="black", lw=1.2); ax.axvline(0, color="black", lw=1.2)
+    xs = np.array([xmin, xmax])
+    for line in spec.get("lines", []):
+        ax.plot(xs, _num(line, "slope") * xs + _num(line, "intercept", 0), color="#2563EB", lw=1.5)
+    for p in spec.get("points", []):
+        x, y = _num(p, "x"), _num(p, "y")
+        ax.plot(x, y, "o", color="#E11D48", markersize=6, zorder=3)
+        if p.get("label"): _text(ax, x, y, f" {p['label']}", ha="left", va="bottom", fontsize=11)
+    ax.set_xlim(xmin, xmax); ax.set_ylim(ymin, ymax)
+    ax.set_xticks(_int_ticks(xmin, xmax))
+    ax.set_yticks(_int_ticks(ymin, ymax))
+    ax.tick_params(labelsize=8)
+
+@primitive("fraction_bar", '"bars": [{"parts": 4, "shaded": 3, "label": "3/4"}]')
+def fraction_bar(ax, spec):
+    bars = spec.get("bars") or [spec]
+    if len(bars) > 6: raise FigureError("분수 막대는 6개까지 그릴 수 있습니다.")
+    for row, bar in enumerate(bars):
+        parts = _int(bar, "parts", lo=1, hi=24)
+        shaded = _int(bar, "shaded", 0, lo=0, hi=parts)
+        y = (len(bars) - 1 - row) * 1.5
+        for i in range(parts):
+            color = "#FCA5A5" if i < shaded else "white"
+            ax.add_patch(patches.Rectangle((i * 10 / parts, y), 10 / parts, 1, facecolor=color, edgecolor="black", lw=1))
+        if bar.get("label"): _text(ax, 10.4, y + 0.5, str(bar["label"]), ha="left", va="center", fontsize=11)
+    ax.set_xlim(-0.2, 12); ax.set_ylim(-0.3, len(bars) * 1.5)
+    ax.axis("off")
+
+@primitive("clock", '"hour": 3, "minute": 30')
+def clock(ax, spec):
+    hour, minute = _num(spec, "hour", lo=0, hi=24) % 12, _num(spec, "minute", 0, lo=0, hi=59)
+    ax.add_patch(patches.Circle((0, 0), 1, facecolor="white", edgecolor="black", lw=2))
+    for x0, y0, x1, y1 in CLOCK_TICKS: ax.plot([x0, x1], [y0, y1], color="black", lw=1)
+    for x, y, s in CLOCK_NUMERALS: _text(ax, x, y, s, ha="center", va="center", fontsize=11)
+    a_min = np.deg2rad(90 - minute * 6)
+    a_hour = np.deg2rad(90 - (hour + minute / 60) * 30)
+    ax.plot([0, 0.5 * np.cos(a_hour)], [0, 0.5 * np.sin(a_hour)], color="black", lw=3.5, solid_capstyle="round")
+    ax.plot([0, 0.75 * np.cos(a_min)], [0, 0.75 * np.sin(a_min)], color="black", lw=2, solid_capstyle="round")
+    ax.plot(0, 0, "o", color="black", markersize=5)
+    ax.set_xlim(-1.1, 1.1); ax.set_ylim(-1.1, 1.1)
+    ax.axis("off")
+
+# -----------------------------------------------------------------------------
+# 5. 렌더링 (같은 인자는 캐시된 PNG 재사용)
+# -----------------------------------------------------------------------------
+def parse_spec(spec):
+    if isinstance(spec, str):
+        try: spec = json.loads(spec)
+        except ValueError as e: raise FigureError(f"그림 인자가 올바른 JSON이 아닙니다: {e}")
+    if not isinstance(spec, dict) or not isinstance(spec.get("type"), str) or spec["type"] not in PRIMITIVES:
+        raise FigureError(f"지원하지 않는 그림 종류입니다: {spec!r}")
+    return spec
+
+@lru_cache(maxsize=256)
+def _render_cached(key):
+    spec = json.loads(key)
+    # pyplot 전역 상태를 쓰지 않는 Figure 객체라 스레드별로 안전하게 그릴 수 있음
+    fig = Figure(figsize=(5, 4))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    PRIMITIVES[spec["type"]](ax, spec)
+    ax.set_aspect("equal", adjustable="box")
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=150, bbox_inches="tight")
+    return buf.getvalue()
+
+def render(spec, font=None):
+    """그림 인자(dict 또는 JSON 문자열)를 PNG 바이트로 변환. 어떤 실패든 FigureError"""
+    try:
+        spec = parse_spec(spec)
+        if font is not None: FONT_PROPS["font"] = font
+        return _render_cached(json.dumps(spec, sort_keys=True, ensure_ascii=False))
+    except FigureError: raise
+    except Exception as e: raise FigureError(f"{type(e).__name__}: {e}")
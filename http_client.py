@@ -0,0 +1,145 @@
+import statistics
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# -----------------------------------------------------------------------------
+# 1. 외부 호출 공통 설정
+# -----------------------------------------------------------------------------
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 15
+POOL_SIZE = 20
+
+FAILURE_THRESHOLD = 5   # 연속 실패가 이만큼 쌓이면 차단
+RESET_AFTER = 30        # 차단 후 이 시간(초)이 지나면 한 번 시험 호출 허용
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+_lock = threading.Lock()
+_session = None
+_breakers = {}
+_metrics = {}
+
+def session():
+    """keep-alive 연결을 재사용하는 공용 세션 (GET/HEAD만 자동 재시도)"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 502, 503, 504), allowed_methods=("GET", "HEAD"))
+                adapter = HTTPAdapter(pool_connections=10, pool_maxsize=POOL_SIZE, max_retries=retry)
+                s = requests.Session()
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+# -----------------------------------------------------------------------------
+# 2. 호스트별 차단기
+# -----------------------------------------------------------------------------
+class CircuitBreaker:
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_after=RESET_AFTER):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None: return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None: return True
+            if time.monotonic() - self.opened_at < self.reset_after or self.trial: return False
+            # 차단 해제 시험 호출은 한 번에 하나만
+            self.trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+class HostMetrics:
+    def __init__(self, max_samples=200):
+        self.latencies = deque(maxlen=max_samples)
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+
+def _for_host(host):
+    with _lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+            _metrics[host] = HostMetrics()
+        return _breakers[host], _metrics[host]
+
+# -----------------------------------------------------------------------------
+# 3. 요청
+# -----------------------------------------------------------------------------
+def request(method, url, timeout=None, **kwargs):
+    host = urlsplit(url).netloc
+    breaker, metrics = _for_host(host)
+    if not breaker.allow():
+        metrics.rejected += 1
+        raise CircuitOpenError(f"{host} 연결이 일시적으로 차단되었습니다. 잠시 후 다시 시도해주세요.")
+
+    started = time.perf_counter()
+    try:
+        response = session().request(method, url, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+    except Exception:
+        metrics.calls += 1; metrics.errors += 1
+        metrics.latencies.append(time.perf_counter() - started)
+        breaker.record_failure()
+        raise
+
+    metrics.calls += 1
+    metrics.latencies.append(time.perf_counter() - started)
+    # 5xx만 장애로 보고, 4xx는 요청 자체의 문제이므로 차단 사유가 아님
+    if response.status_code >= 500:
+        metrics.errors += 1
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return response
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+def host_report():
+    with _lock:
+        items = sorted(_metrics.items())
+    rows = []
+    for host, m in items:
+        latencies = sorted(m.latencies)
+        rows.append({
+            "호스트": host,
+            "상태": _breakers[host].state,
+            "호출 수": m.calls,
+            "오류": m.errors,
+            "차단": m.rejected,
+            "p50(ms)": round(statistics.median(latencies) * 1000) if latencies else 0,
+            "p95(ms)": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000) if latencies else 0,
+        })
+    return rows
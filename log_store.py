@@ -0,0 +1,212 @@
+import csv
+import gzip
+import io
+import re
+import time
+from datetime import datetime, timedelta
+
+import shared_state
+
+# -----------------------------------------------------------------------------
+# 1. 로그 저장 구조
+# -----------------------------------------------------------------------------
+# logs_YYYY_MM : 이번 달 로그 (새 기록은 여기에만 추가)
+# log_archive  : 지난 달 로그를 드라이브 CSV(gzip)로 옮긴 목록
+# log_summary  : 사용자별 누적 건수 / 마지막 무료 사용일
+LEGACY_SHEET = "logs"
+PARTITION_RE = re.compile(r"^logs_\d{4}_\d{2}$")
+SUMMARY_SHEET = "log_summary"
+ARCHIVE_SHEET = "log_archive"
+
+LOG_HEADER = ["date", "username", "type", "detail", "extra1", "extra2", "extra3", "file_id"]
+SUMMARY_HEADER = ["username", "total", "generated", "daily_free", "payments", "last_free_date", "last_activity"]
+ARCHIVE_HEADER = ["partition", "file_id", "rows", "archived_at"]
+
+# 보관 안 된 지난 시트가 남아 있는지 프로세스마다 이 간격으로 확인 (업로드 실패 시 재시도)
+COMPACT_INTERVAL = 600
+_last_compact = 0.0
+
+# 워크시트 핸들 / 요약 행 번호는 프로세스 안에서 재사용 (기록 한 번당 시트 호출 수를 줄임)
+_handles = {}       # (스프레드시트 id, 시트 이름) -> 워크시트
+_summary_rows = {}  # (스프레드시트 id, 사용자) -> 요약 시트 행 번호
+
+def kst_now():
+    return datetime.now() + timedelta(hours=9)
+
+def partition_name(dt=None):
+    return f"logs_{(dt or kst_now()):%Y_%m}"
+
+def is_log_sheet(title):
+    return title == LEGACY_SHEET or bool(PARTITION_RE.match(title))
+
+def _worksheet(spreadsheet, title, header, create=True):
+    """(워크시트, 새로 만들었는지) 반환. create=False면 없을 때 (None, False)"""
+    import gspread
+    try: return spreadsheet.worksheet(title), False
+    except gspread.WorksheetNotFound:
+        if not create: return None, False
+    try:
+        ws = spreadsheet.add_worksheet(title=title, rows=1000, cols=len(header))
+    except gspread.exceptions.APIError:
+        # 다른 프로세스가 먼저 만든 경우
+        return spreadsheet.worksheet(title), False
+    ws.append_row(header)
+    return ws, True
+
+def _cached_worksheet(spreadsheet, title, header, create=True):
+    key = (spreadsheet.id, title)
+    ws = _handles.get(key)
+    if ws is None:
+        ws = _worksheet(spreadsheet, title, header, create)[0]
+        if ws is not None: _handles[key] = ws
+    return ws
+
+# -----------------------------------------------------------------------------
+# 2. 요약 테이블 (여러 프로세스가 읽고-고쳐-쓰므로 shared_state 잠금 안에서만 수정)
+# -----------------------------------------------------------------------------
+def _apply_rows(summary, rows):
+    """summary: SUMMARY_HEADER 순서의 리스트. 로그 행들을 반영한 새 리스트 반환"""
+    s = list(summary) + [""] * (len(SUMMARY_HEADER) - len(summary))
+    for i in range(1, 5):
+        try: s[i] = int(s[i] or 0)
+        except ValueError: s[i] = 0
+    for row in rows:
+        if len(row) < 3: continue
+        s[1] += 1
+        if row[2] == "문제생성": s[2] += 1
+        elif row[2] == "결제완료": s[4] += 1
+        if len(row) > 4 and row[4] == "DAILY_FREE":
+            s[3] += 1
+            s[5] = max(str(s[5]), row[0][:10])
+        s[6] = max(str(s[6]), row[0])
+    return s
+
+def _summary_row(spreadsheet, ws, username):
+    """(행 번호, 현재 값) 반환. 없으면 (None, None)"""
+    key = (spreadsheet.id, username)
+    row_no = _summary_rows.get(key)
+    if row_no is not None:
+        values = ws.row_values(row_no)
+        if values[:1] == [username]: return row_no, values
+    cell = ws.find(username, in_column=1)
+    if not cell:
+        _summary_rows.pop(key, None)
+        return None, None
+    _summary_rows[key] = cell.row
+    return cell.row, ws.row_values(cell.row)
+
+def update_summary(spreadsheet, row):
+    ws = _cached_worksheet(spreadsheet, SUMMARY_SHEET, SUMMARY_HEADER)
+    with shared_state.lease(SUMMARY_SHEET):
+        row_no, values = _summary_row(spreadsheet, ws, row[1])
+        if row_no:
+            ws.update(range_name=f"A{row_no}:G{row_no}", values=[_apply_rows(values, [row])])
+        else:
+            ws.append_row(_apply_rows([row[1]], [row]))
+
+def merge_summary(spreadsheet, rows):
+    """여러 로그 행을 한 번에 요약에 반영 (기존 logs 시트 이전용)"""
+    ws = _cached_worksheet(spreadsheet, SUMMARY_SHEET, SUMMARY_HEADER)
+    by_user = {}
+    for row in rows:
+        if len(row) > 1 and row[1]: by_user.setdefault(row[1], []).append(row)
+    with shared_state.lease(SUMMARY_SHEET, ttl=120, wait=60):
+        values = ws.get_all_values()
+        table = {r[0]: r for r in values[1:] if r}
+        for username, user_rows in by_user.items():
+            table[username] = _apply_rows(table.get(username, [username]), user_rows)
+        ws.update(range_name="A1", values=[SUMMARY_HEADER] + list(table.values()))
+        _summary_rows.clear()
+
+def read_summary(spreadsheet, username):
+    ws = _cached_worksheet(spreadsheet, SUMMARY_SHEET, SUMMARY_HEADER, create=False)
+    if ws is None: return None
+    row_no, values = _summary_row(spreadsheet, ws, username)
+    if not row_no: return None
+    return dict(zip(SUMMARY_HEADER, _apply_rows(values, [])))
+
+# -----------------------------------------------------------------------------
+# 3. 기록 / 읽기
+# -----------------------------------------------------------------------------
+def append_log(spreadsheet, row, archiver=None):
+    _cached_worksheet(spreadsheet, partition_name(), LOG_HEADER).append_row(row)
+    update_summary(spreadsheet, row)
+    if archiver is not None: maybe_compact(spreadsheet, archiver)
+
+def _live_sheets(spreadsheet):
+    """시트에 남아 있는 로그 시트 (기존 logs 먼저, 그다음 월 순서)"""
+    sheets = [ws for ws in spreadsheet.worksheets() if is_log_sheet(ws.title)]
+    return sorted(sheets, key=lambda ws: (ws.title != LEGACY_SHEET, ws.title))
+
+def read_live_rows(spreadsheet, skip=()):
+    """이번 달 + 아직 보관되지 않은 지난 시트의 로그 (헤더 포함, 오래된 순)"""
+    rows = [LOG_HEADER]
+    sheets = [ws for ws in _live_sheets(spreadsheet) if ws.title not in skip]
+    if not sheets: return rows
+    # 시트가 여러 개여도 한 번의 요청으로 읽음
+    ranges = spreadsheet.values_batch_get([f"'{ws.title}'" for ws in sheets]).get("valueRanges", [])
+    for value_range in ranges:
+        rows.extend(value_range.get("values", [])[1:])
+    return rows
+
+# -----------------------------------------------------------------------------
+# 4. 지난 파티션 보관 (드라이브 CSV.gz + 목록)
+# -----------------------------------------------------------------------------
+def _to_csv_gz(rows):
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return gzip.compress(text.getvalue().encode("utf-8"))
+
+def _from_csv_gz(data):
+    return list(csv.reader(io.StringIO(gzip.decompress(data).decode("utf-8"))))
+
+def maybe_compact(spreadsheet, archiver):
+    """COMPACT_INTERVAL마다 지난 시트가 남아 있으면 보관 (여러 프로세스 중 하나만 실행)"""
+    global _last_compact
+    now = time.monotonic()
+    if now - _last_compact < COMPACT_INTERVAL: return
+    _last_compact = now
+    token = shared_state.acquire_lease(ARCHIVE_SHEET, ttl=300)
+    if token is None: return
+    try: compact_partitions(spreadsheet, archiver)
+    except Exception as e: print(f"로그 보관 실패: {e}")
+    finally: shared_state.release_lease(ARCHIVE_SHEET, token)
+
+def compact_partitions(spreadsheet, archiver):
+    """archiver.upload(name, bytes) -> file_id. 이번 달이 아닌 파티션을 보관하고 시트에서 삭제"""
+    current = partition_name()
+    stale = [ws for ws in _live_sheets(spreadsheet) if ws.title != current]
+    if not stale: return
+    index, _ = _worksheet(spreadsheet, ARCHIVE_SHEET, ARCHIVE_HEADER)
+    # 시트 이름 -> (목록 행 번호, 드라이브 file_id). file_id가 비어 있으면 요약 합산만 끝나고 업로드 전
+    entries = {r[0]: (n, r[1] if len(r) > 1 else "") for n, r in enumerate(index.get_all_values(), start=1) if n > 1 and r}
+    for ws in stale:
+        rows = ws.get_all_values()
+        entry = entries.get(ws.title)
+        if len(rows) > 1 and not (entry and entry[1]):
+            if ws.title == LEGACY_SHEET and entry is None:
+                # 요약 테이블 도입 전 기록이므로 요약에 합산. 목록에 먼저 남겨 재시도 때 두 번 합산하지 않음
+                # (업로드 실패와 상관없이 배포 직후 바로 무료 사용 여부에 반영되도록 업로드보다 먼저)
+                index.append_row([ws.title, "", len(rows) - 1, kst_now().strftime("%Y-%m-%d %H:%M:%S")])
+                entry = (len(index.col_values(1)), "")
+                merge_summary(spreadsheet, rows[1:])
+            file_id = archiver.upload(f"{ws.title}.csv.gz", _to_csv_gz(rows))
+            if not file_id: continue  # 업로드 실패 시 시트를 지우지 않음 (다음 확인 때 재시도)
+            if entry: index.update_cell(entry[0], 2, file_id)
+            else: index.append_row([ws.title, file_id, len(rows) - 1, kst_now().strftime("%Y-%m-%d %H:%M:%S")])
+        spreadsheet.del_worksheet(ws)
+        _handles.pop((spreadsheet.id, ws.title), None)
+
+def read_all_rows(spreadsheet, archiver, username=None):
+    """archiver.download(file_id) -> bytes. 보관된 로그 + 시트에 남은 로그를 오래된 순서로 (헤더 포함)"""
+    index, _ = _worksheet(spreadsheet, ARCHIVE_SHEET, ARCHIVE_HEADER, create=False)
+    # file_id가 빈 항목은 아직 업로드 전(시트에 그대로 남아 있음)
+    entries = [r for r in index.get_all_values()[1:] if len(r) > 1 and r[1]] if index is not None else []
+    entries.sort(key=lambda r: (r[0] != LEGACY_SHEET, r[0]))
+    rows = [LOG_HEADER]
+    for entry in entries:
+        rows.extend(_from_csv_gz(archiver.download(entry[1]))[1:])
+    # 보관 목록에 올라갔지만 아직 삭제되지 않은 시트는 중복이므로 제외
+    rows.extend(read_live_rows(spreadsheet, skip={entry[0] for entry in entries})[1:])
+    if username is None: return rows
+    return [rows[0]] + [row for row in rows[1:] if len(row) > 1 and row[1] == username]
@@ -1,22 +1,35 @@
-import google.generativeai as genai
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import matplotlib.font_manager as fm
+# matplotlib, python-docx, google.generativeai는 불러오는 데만 수 초가 걸려
+# 로그인 화면에는 필요 없으므로 쓰는 함수 안에서 불러옴 (워밍업 스레드가 미리 불러 둠)
 import io
+import json
 import os
-import requests
+import re
+import statistics
+import threading
+import time
+import http_client
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 
 # -----------------------------------------------------------------------------
 # 1. AI 모델 설정
 # -----------------------------------------------------------------------------
+# 요청 모양(난이도, 무료 여부)에 따라 가벼운 모델과 강한 모델을 나눠 씀
+MODEL_TIERS = {
+    "fast": "models/gemini-2.5-flash-lite",
+    "standard": "models/gemini-2.5-flash",
+}
+TIER_POLICY = {"default": "standard", "daily_free": "fast", "하": "fast", "최상": "standard"}
+# 100만 토큰당 가격(USD): (입력, 출력)
+TIER_PRICES = {"fast": (0.10, 0.40), "standard": (0.30, 2.50)}
+# 모델 호출 한 번의 최대 대기 시간(초). 응답이 멈춰도 기다리는 사용자들이 무한정 묶이지 않도록
+MODEL_TIMEOUT = 90
+
 model = None
+models = {}
 api_key_status = "키 없음"
+_api_key = None
+_models_lock = threading.Lock()
 
 try:
     # secrets.toml에서 google_api_key를 찾습니다.
@@ -27,34 +40,71 @@ try:
         if isinstance(api_key, dict) and "api_key" in api_key:
             api_key = api_key["api_key"]
             
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('models/gemini-2.5-flash')
-        api_key_status = "설정 완료"
+        if "model_policy" in st.secrets:
+            policy = st.secrets["model_policy"]
+            MODEL_TIERS.update(dict(policy.get("tiers", {})))
+            TIER_POLICY.update(dict(policy.get("policy", {})))
+            TIER_PRICES.update({k: tuple(v) for k, v in dict(policy.get("prices", {})).items()})
+            MODEL_TIMEOUT = policy.get("timeout", MODEL_TIMEOUT)
+
+        _api_key = api_key
+        api_key_status = "설정 대기"
     else:
         api_key_status = "Secrets에 google_api_key 없음"
 except Exception as e:
     api_key_status = f"설정 오류: {e}"
     print(f"모델 설정 오류: {e}")
 
+def init_models():
+    """Gemini 설정과 모델 생성. 처음 필요할 때(또는 워밍업 스레드에서) 한 번만 실행"""
+    global model, models, api_key_status
+    if models or _api_key is None: return models
+    with _models_lock:
+        if models: return models
+        try:
+            import google.generativeai as genai
+            genai.configure(api_key=_api_key)
+            built = {tier: genai.GenerativeModel(name) for tier, name in MODEL_TIERS.items()}
+            model = built.get(TIER_POLICY["default"])
+            models = built
+            api_key_status = "설정 완료"
+        except Exception as e:
+            api_key_status = f"설정 오류: {e}"
+            print(f"모델 설정 오류: {e}")
+    return models
+
 # -----------------------------------------------------------------------------
 # 2. 폰트 자동 다운로드
 # -----------------------------------------------------------------------------
 FONT_FILE = "NanumGothic.ttf"
 FONT_URL = "https://github.com/google/fonts/raw/main/ofl/nanumgothic/NanumGothic-Regular.ttf"
 
+_korean_font = None
+
 def get_korean_font():
+    global _korean_font
+    if _korean_font is not None: return _korean_font
     if not os.path.exists(FONT_FILE):
         try:
-            response = requests.get(FONT_URL)
+            response = http_client.get(FONT_URL, timeout=(http_client.CONNECT_TIMEOUT, 10))
+            response.raise_for_status()
             with open(FONT_FILE, "wb") as f: f.write(response.content)
-        except: pass
-    try: return fm.FontProperties(fname=FONT_FILE)
+        except Exception as e: print(f"폰트 다운로드 실패: {e}")
+    # 처음 불러올 때 matplotlib 폰트 캐시를 만듦 (새 서버에서는 수 초)
+    import matplotlib.font_manager as fm
+    try:
+        # 폰트 목록에 한 번만 등록하고 FontProperties는 재사용
+        fm.fontManager.addfont(FONT_FILE)
+        _korean_font = fm.FontProperties(fname=FONT_FILE)
+        return _korean_font
     except: return fm.FontProperties(family="sans-serif")
 
 # -----------------------------------------------------------------------------
 # 3. 문서 유틸리티
 # -----------------------------------------------------------------------------
 def set_read_only(doc):
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
     settings = doc.settings.element
     protection = OxmlElement('w:documentProtection')
     protection.set(qn('w:edit'), 'readOnly')
@@ -62,6 +112,8 @@ def set_read_only(doc):
     settings.append(protection)
 
 def set_font(run, font_name='맑은 고딕', font_size=11, bold=False, color=None):
+    from docx.oxml.ns import qn
+    from docx.shared import Pt
     run.font.name = font_name
     run._element.rPr.rFonts.set(qn('w:eastAsia'), font_name)
     run.font.size = Pt(font_size)
@@ -69,6 +121,8 @@ def set_font(run, font_name='맑은 고딕', font_size=11, bold=False, color=Non
     if color: run.font.color.rgb = color
 
 def add_page_number(run):
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
     fldChar1 = OxmlElement('w:fldChar')
     fldChar1.set(qn('w:fldCharType'), 'begin')
     instrText = OxmlElement('w:instrText')
@@ -84,7 +138,13 @@ def add_page_number(run):
 # 4. 그래프 생성
 # -----------------------------------------------------------------------------
 def create_plot_image(code_snippet):
+    return render_plot(code_snippet)[0]
+
+def render_plot(code_snippet):
+    """그림 코드를 실행해 (PNG 버퍼, 오류 메시지)를 반환. 성공하면 오류는 None"""
     kor_font = get_korean_font()
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
     plt.clf()
     plt.style.use('default')
     plt.rcParams['axes.unicode_minus'] = False
@@ -116,15 +176,45 @@ def create_plot_image(code_snippet):
         plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
         plt.close(fig)
         buf.seek(0)
-        return buf
+        return buf, None
     except Exception as e:
         plt.close(fig)
-        return None
+        return None, f"{type(e).__name__}: {e}"
+
+def warm_up_rendering():
+    """그림 함수/그림 코드 실행에 쓰는 모듈을 미리 불러오고 한 번 그려 둠 (워밍업 스레드용)"""
+    import figures
+    import matplotlib.pyplot
+    figures.render({"type": "clock", "hour": 3, "minute": 0}, font=get_korean_font())
+
+def render_figure(prob):
+    """그림 함수(FIGURE)를 우선 사용하고, 실패하거나 없으면 자유 코드로 대체. (PNG 바이트, 오류) 반환"""
+    error = None
+    if prob.figure:
+        import figures
+        try: return figures.render(prob.figure, font=get_korean_font()), None
+        except figures.FigureError as e: error = str(e)
+    if prob.code:
+        buf, error = render_plot(prob.code)
+        if buf is not None: return buf.getvalue(), None
+    return None, error
 
 # -----------------------------------------------------------------------------
-# 5. 콘텐츠 생성 (에러 처리 강화)
+# 5. 오류 문서
 # -----------------------------------------------------------------------------
-def create_error_docx(error_msg):
+def save_docx(doc, out=None):
+    """out(파일 경로)이 주어지면 디스크에 바로 저장하고, 없으면 메모리 버퍼로 반환"""
+    if out is not None:
+        doc.save(out)
+        return out
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+def create_error_docx(error_msg, out=None):
+    from docx import Document
+    from docx.shared import RGBColor
     doc = Document()
     doc.add_heading('⚠️ 문제 생성 실패', 0)
     p = doc.add_paragraph()
@@ -136,41 +226,419 @@ def create_error_docx(error_msg):
     doc.add_paragraph("2. API Key가 올바른지(오타, 공백) 확인하세요.")
     doc.add_paragraph(f"현재 상태: {api_key_status}")
     
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    return save_docx(doc, out)
 
-def generate_math_docx(school, grade, topic, difficulty, count, is_commercial=False):
-    
-    if not model:
-        return create_error_docx("AI 모델(Gemini)이 설정되지 않았습니다. API Key를 확인해주세요.")
+# -----------------------------------------------------------------------------
+# 6. 응답 파싱 (구조화 JSON 우선, 기존 텍스트 형식은 대체 경로)
+# -----------------------------------------------------------------------------
+STRUCTURED_OUTPUT = True
 
-    system_prompt = f"""
-    당신은 대한민국 수학 최상위권 교재 집필진입니다.
-    요청: {school} {grade}학년 '{topic}' (난이도: {difficulty}) {count}문제.
+STATUS_OK = "ok"
+STATUS_NO_ANSWER = "no_answer"
+STATUS_UNCLOSED_CODE = "unclosed_code"
+STATUS_INVALID = "invalid"
+STATUS_BAD_FIGURE = "bad_figure"
 
-    [작성 규칙]
-    1. 사고력, 문장제, 도형 위주 출제.
-    2. 모든 문제에 Python Matplotlib 시각화 코드 필수.
-    3. 그림은 '교과서 삽화' 스타일 (축 숨기기, patches 사용).
-    
+PROBLEM_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "question": {"type": "STRING"},
+            "figure": {"type": "STRING"},
+            "code": {"type": "STRING"},
+            "answer": {"type": "STRING"},
+        },
+        "required": ["question", "answer"],
+    },
+}
+
+class Problem:
+    __slots__ = ("question", "figure", "code", "answer", "status", "image")
+
+    def __init__(self, question="", code="", answer="", status=STATUS_OK, figure=""):
+        self.question = question
+        self.figure = figure
+        self.code = code
+        self.answer = answer
+        self.status = status
+        self.image = None
+
+    def __repr__(self):
+        return f"Problem(status={self.status!r}, question={self.question[:20]!r})"
+
+    def without_image(self):
+        """그린 그림(PNG 바이트)만 뺀 사본. 문서를 만들 때 다시 그림 (그림 함수는 figures 캐시 재사용)"""
+        return Problem(self.question, self.code, self.answer, self.status, self.figure)
+
+def _problem_from_parts(question, code, answer, status=STATUS_OK, figure=""):
+    question, code, answer = question.strip(), code.strip(), answer.strip()
+    if isinstance(figure, dict): figure = json.dumps(figure, ensure_ascii=False)
+    figure = str(figure or "").strip()
+    if status == STATUS_OK and not answer: status = STATUS_NO_ANSWER
+    if not question: status = STATUS_INVALID
+    return Problem(question, code, answer, status, figure)
+
+def parse_json_problems(raw_text):
+    """구조화 응답(JSON 배열)을 Problem 리스트로 변환. JSON이 아니면 None"""
+    try: data = json.loads(raw_text)
+    except (TypeError, ValueError): return None
+    if isinstance(data, dict): data = data.get("problems", [])
+    if not isinstance(data, list): return None
+
+    problems = []
+    for item in data:
+        if not isinstance(item, dict):
+            problems.append(Problem(status=STATUS_INVALID))
+            continue
+        problems.append(_problem_from_parts(str(item.get("question") or ""), str(item.get("code") or ""), str(item.get("answer") or ""), figure=item.get("figure") or ""))
+    return problems
+
+PROBLEM_HEADER = re.compile(r"^\s*문제\s*\d+\s*[:.]\s*")
+
+def parse_text_problems(raw_text):
+    """기존 텍스트 형식(문제/FIGURE/CODE_START/CODE_END/정답/@@@)을 한 번에 훑어서 파싱"""
+    problems = []
+    q_lines, code_lines, answer, figure = [], [], "", ""
+    in_code = unclosed = False
+
+    def flush():
+        nonlocal q_lines, code_lines, answer, figure, in_code, unclosed
+        if q_lines or code_lines or answer or figure:
+            status = STATUS_UNCLOSED_CODE if (in_code or unclosed) else STATUS_OK
+            problems.append(_problem_from_parts("\n".join(q_lines), "\n".join(code_lines), answer, status, figure))
+        q_lines, code_lines, answer, figure = [], [], "", ""
+        in_code = unclosed = False
+
+    for line in raw_text.splitlines():
+        stripped = line.strip()
+        if "@@@" in stripped:
+            flush(); continue
+        if in_code:
+            if "CODE_END" in stripped:
+                in_code = False
+                continue
+            if not (stripped.startswith("정답:") or PROBLEM_HEADER.match(line)):
+                if not stripped.startswith("```"): code_lines.append(line)
+                continue
+            # CODE_END 누락: 코드 블록을 여기서 닫고 현재 줄은 일반 처리
+            in_code, unclosed = False, True
+        if "CODE_START" in stripped:
+            in_code = True
+        elif stripped.startswith("정답:"):
+            answer = stripped[len("정답:"):]
+        elif stripped.startswith("FIGURE:"):
+            figure = stripped[len("FIGURE:"):]
+        elif PROBLEM_HEADER.match(line):
+            # 구분자(@@@)가 빠져도 다음 문제 번호에서 끊어서 두 문제가 합쳐지지 않도록 함
+            if q_lines or code_lines or answer or figure: flush()
+            rest = PROBLEM_HEADER.sub("", line, count=1)
+            if rest.strip(): q_lines.append(rest)
+        elif "CODE_END" not in stripped:
+            q_lines.append(line)
+    flush()
+    return problems
+
+# -----------------------------------------------------------------------------
+# 7. 문제 요청
+# -----------------------------------------------------------------------------
+TEXT_FORMAT = """
     [출력 형식]
     문제 1: ...
-    CODE_START
-    ...
-    CODE_END
+    FIGURE: {"type": ..., ...}
     정답: ...
     @@@
+    (목록에 맞는 그림이 없을 때만 FIGURE 대신 CODE_START / Matplotlib 코드 / CODE_END)
     """
 
+JSON_FORMAT = """
+    [출력 형식]
+    JSON 배열로만 답하세요. 각 원소는 {"question": 문제 본문, "figure": 그림 JSON 문자열, "answer": 정답}.
+    목록에 맞는 그림이 없을 때만 "figure" 대신 "code"에 Matplotlib 코드를 넣으세요.
+    """
+
+def _figure_rules():
+    import figures
+    return f"""
+    [그림 목록] 아래 중 하나를 골라 JSON 인자만 지정 (코드 작성 금지)
+{figures.catalog_prompt()}
+    """
+
+def _rules_prompt(school, grade, topic, difficulty, count):
+    return f"""
+    당신은 대한민국 수학 최상위권 교재 집필진입니다.
+    요청: {school} {grade}학년 '{topic}' (난이도: {difficulty}) {count}문제.
+
+    [작성 규칙]
+    1. 사고력, 문장제, 도형 위주 출제.
+    2. 모든 문제에 그림 필수. 그림은 '교과서 삽화' 스타일.
+    """ + _figure_rules()
+
+def build_text_prompt(school, grade, topic, difficulty, count):
+    return _rules_prompt(school, grade, topic, difficulty, count) + TEXT_FORMAT
+
+def build_json_prompt(school, grade, topic, difficulty, count):
+    return _rules_prompt(school, grade, topic, difficulty, count) + JSON_FORMAT
+
+def build_repair_prompt(prob, reason, context, structured):
+    fmt = JSON_FORMAT.replace("JSON 배열로만 답하세요.", "JSON 배열(원소 1개)로만 답하세요.") if structured else TEXT_FORMAT
+    return f"""
+    아래 수학 문제 1개에 오류가 있습니다. 같은 내용과 난이도로 고쳐서 다시 작성하세요.
+    요청: {context}
+    - 그림은 목록의 이름과 인자 범위를 지키고, 코드를 쓴다면 plt, ax, fig, patches만 사용해 오류 없이 실행되어야 합니다.
+    - 정답을 반드시 포함하세요.
+
+    [기존 문제]
+    {prob.question}
+
+    [기존 그림]
+    {prob.figure or prob.code or "(없음)"}
+
+    [기존 정답]
+    {prob.answer or "(없음)"}
+
+    [오류 내용]
+    {reason}
+    """ + _figure_rules() + fmt
+
+def build_replacement_prompt(context, existing, structured):
+    fmt = JSON_FORMAT.replace("JSON 배열로만 답하세요.", "JSON 배열(원소 1개)로만 답하세요.") if structured else TEXT_FORMAT
+    listed = "\n".join(f"    - {q}" for q in existing) or "    (없음)"
+    return f"""
+    요청한 문제 수보다 적게 작성되어 1문제가 모자랍니다. 같은 단원과 난이도로 새 문제 1개를 작성하세요.
+    요청: {context}
+    - 아래 이미 만든 문제와 겹치지 않게 작성하세요.
+    - 정답을 반드시 포함하세요.
+
+    [이미 만든 문제]
+{listed}
+    """ + _figure_rules() + fmt
+
+def _call_model(json_prompt, text_prompt, tier, shape):
+    if STRUCTURED_OUTPUT:
+        import google.generativeai as genai
+        from google.api_core.exceptions import InvalidArgument
+        # 스키마가 거부됐거나 응답을 읽지 못한 경우에만 텍스트 형식으로 다시 요청
+        # (할당량/429/시간 초과/연결 오류는 그대로 올려 보냄: 다시 보내면 비용과 지연만 두 배)
+        response = None
+        try:
+            config = genai.GenerationConfig(response_mime_type="application/json", response_schema=PROBLEM_SCHEMA)
+            response = _generate(json_prompt, tier, shape, generation_config=config)
+        except (InvalidArgument, TypeError) as e:
+            print(f"구조화 응답 스키마 거부, 텍스트 형식으로 재시도: {e}")
+        if response is not None:
+            try: raw_text = response.text
+            except ValueError: raw_text = ""  # 차단 등으로 본문이 없는 응답
+            problems = parse_json_problems(raw_text)
+            if problems is None: problems = parse_text_problems(raw_text)
+            if problems: return problems
+            print("구조화 응답을 읽지 못해 텍스트 형식으로 재시도")
+
+    return parse_text_problems(_generate(text_prompt, tier, shape).text)
+
+def request_problems(school, grade, topic, difficulty, count, tier="standard", daily_free=False):
+    args = (school, grade, topic, difficulty, count)
+    # 매일 무료 학습지는 같은 난이도/문제 수의 유료 요청과 따로 집계 (무료 정책 평가용)
+    shape = f"{'무료/' if daily_free else ''}{difficulty}/{count}문제"
+    return _call_model(build_json_prompt(*args), build_text_prompt(*args), tier, shape)[:count]
+
+# -----------------------------------------------------------------------------
+# 8. 검증 및 실패 문항만 재생성
+# -----------------------------------------------------------------------------
+MAX_REPAIR_ROUNDS = 2
+MAX_REPAIR_WORKERS = 4
+MISSING_REASON = "모델이 요청한 수보다 적게 작성해 빠진 문항입니다."
+
+def validate_problem(prob):
+    """그림 코드를 실제로 실행하고 정답 유무를 확인. 실패 사유(없으면 None) 반환"""
+    if prob.status == STATUS_INVALID: return "문제 본문이 없습니다."
+    if prob.status == STATUS_UNCLOSED_CODE: return "CODE_END 구분자가 빠졌습니다."
+    if prob.figure or prob.code:
+        # 캐시된 문제를 여러 요청이 같이 쓰므로 버퍼 대신 바이트로 보관
+        prob.image, error = render_figure(prob)
+        if prob.image is None:
+            prob.status = STATUS_BAD_FIGURE
+            return f"그림 오류: {error}"
+    if not prob.answer:
+        prob.status = STATUS_NO_ANSWER
+        return "정답이 없습니다."
+    prob.status = STATUS_OK
+    return None
+
+def _repair_one(prob, reason, context, tier, existing, shape="재생성"):
+    if prob is None:
+        # 빠진 문항은 고칠 원본이 없으므로 새로 요청
+        prompts = [build_replacement_prompt(context, existing, structured) for structured in (True, False)]
+    else:
+        prompts = [build_repair_prompt(prob, reason, context, structured) for structured in (True, False)]
+    problems = _call_model(*prompts, tier, shape)
+    return problems[0] if problems else None
+
+def repair_problems(problems, context, tier="standard", max_rounds=MAX_REPAIR_ROUNDS, count=None, daily_free=False):
+    """실패한 문항과 빠진 문항(count보다 모자란 만큼)을 모아 동시에 재요청. 시도 횟수는 max_rounds로 제한.
+    끝까지 채우지 못한 빠진 자리는 None으로 남음"""
+    problems = list(problems) + [None] * max(0, (count or 0) - len(problems))
+    shape = "무료/재생성" if daily_free else "재생성"
+    failures = {}
+    for i, prob in enumerate(problems):
+        reason = MISSING_REASON if prob is None else validate_problem(prob)
+        if reason: failures[i] = reason
+
+    for _ in range(max_rounds):
+        if not failures: break
+        existing = [p.question for p in problems if p is not None and p.question]
+        # 모델 호출만 병렬로 하고, matplotlib 렌더링은 현재 스레드에서 처리
+        with ThreadPoolExecutor(max_workers=min(MAX_REPAIR_WORKERS, len(failures))) as pool:
+            futures = {i: pool.submit(_repair_one, problems[i], reason, context, tier, existing, shape) for i, reason in failures.items()}
+        next_failures = {}
+        for i, future in futures.items():
+            try: fixed = future.result()
+            except Exception as e:
+                print(f"문항 {i+1} 재생성 실패: {e}")
+                fixed = None
+            if fixed is None:
+                next_failures[i] = failures[i]
+                continue
+            reason = validate_problem(fixed)
+            if reason: next_failures[i] = reason
+            if not reason or fixed.status != STATUS_INVALID: problems[i] = fixed
+        failures = next_failures
+    return problems
+
+# -----------------------------------------------------------------------------
+# 9. 동일 요청 합치기 + 단기 캐시
+# -----------------------------------------------------------------------------
+CACHE_POLICY = {
+    "enabled": True,
+    "ttl": 600,                # 캐시 유지 시간(초)
+    "reuse_same_user": False,  # 같은 사용자에게 같은 문제 세트를 다시 주지 않음
+    "max_reuse": 20,           # 한 세트를 받을 수 있는 최대 사용자 수
+    "wait_timeout": 240,       # 먼저 시작한 요청을 기다리는 최대 시간(초). 넘으면 직접 생성
+    "max_entries": 64,         # 캐시에 보관하는 최대 문제 세트 수 (넘으면 오래된 것부터 삭제)
+}
+
+try:
+    if "generation_cache" in st.secrets:
+        CACHE_POLICY.update(dict(st.secrets["generation_cache"]))
+except Exception as e:
+    print(f"캐시 설정 오류: {e}")
+
+class _Flight:
+    __slots__ = ("event", "users", "result")
+
+    def __init__(self, username):
+        self.event = threading.Event()
+        self.users = {username}
+        self.result = None
+
+class GenerationCache:
+    """같은 (학교, 학년, 단원, 난이도, 문제 수) 요청은 모델 호출 한 번을 같이 씀.
+    compact: 캐시에 넣기 전에 결과를 가볍게 만드는 함수 (예: 그린 그림 빼기)"""
+
+    def __init__(self, policy, compact=None):
+        self.policy = policy
+        self.compact = compact
+        self._lock = threading.Lock()
+        self._entries = {}   # key -> [만료 시각, 문제 리스트, 받은 사용자 set]
+        self._inflight = {}  # key -> _Flight
+        self._stats = {"hits": 0, "coalesced": 0, "misses": 0}
+
+    def _allowed(self, users, username):
+        if len(users) >= self.policy["max_reuse"]: return False
+        return self.policy["reuse_same_user"] or username not in users
+
+    def get_or_generate(self, key, username, producer):
+        if not self.policy["enabled"] or username is None:
+            return producer()
+
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._entries.get(key)
+            if entry and entry[0] > now and self._allowed(entry[2], username):
+                entry[2].add(username)
+                self._stats["hits"] += 1
+                return entry[1]
+
+            flight = self._inflight.get(key)
+            if flight and self._allowed(flight.users, username):
+                flight.users.add(username)
+                self._stats["coalesced"] += 1
+                waiting = True
+            else:
+                # 진행 중인 요청을 같이 쓸 수 없으면(같은 사용자 등) 따로 생성
+                self._stats["misses"] += 1
+                waiting = False
+                if flight is None:
+                    flight = _Flight(username)
+                    self._inflight[key] = flight
+                else:
+                    flight = _Flight(username)
+
+        if waiting:
+            flight.event.wait(self.policy["wait_timeout"])
+            if flight.result: return flight.result
+            # 먼저 시작한 요청이 실패했거나 너무 오래 걸리면 직접 생성
+            return producer()
+
+        try:
+            flight.result = producer()
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight: del self._inflight[key]
+                if flight.result:
+                    stored = self.compact(flight.result) if self.compact else flight.result
+                    self._entries.pop(key, None)
+                    self._entries[key] = [time.time() + self.policy["ttl"], stored, set(flight.users)]
+                self._evict(time.time())
+            flight.event.set()
+        return flight.result
+
+    def _evict(self, now):
+        for key in [k for k, e in self._entries.items() if e[0] <= now]:
+            del self._entries[key]
+        # 넣은 순서 = 만료 순서이므로 앞에서부터 삭제
+        while len(self._entries) > self.policy["max_entries"]:
+            del self._entries[next(iter(self._entries))]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), inflight=len(self._inflight))
+
+# 그림 PNG는 세트마다 수 MB가 될 수 있으므로 캐시에는 문제 내용만 보관
+generation_cache = GenerationCache(CACHE_POLICY, compact=lambda problems: [p.without_image() for p in problems])
+
+# -----------------------------------------------------------------------------
+# 10. 학습지 생성
+# -----------------------------------------------------------------------------
+def _produce_problems(school, grade, topic, difficulty, count, tier, daily_free=False):
+    problems = request_problems(school, grade, topic, difficulty, count, tier, daily_free)
+    context = f"{school} {grade}학년 '{topic}' (난이도: {difficulty})"
+    repaired = repair_problems(problems, context, tier, count=count, daily_free=daily_free)
+    return [p for p in repaired if p is not None and p.status != STATUS_INVALID]
+
+def generate_math_docx(school, grade, topic, difficulty, count, is_commercial=False, username=None, daily_free=False, out=None):
+    """(학습지, 실제로 담긴 문제 수) 반환. 오류 안내 문서면 문제 수는 0 (이용권은 담긴 만큼만 차감)"""
+    if not init_models():
+        return create_error_docx("AI 모델(Gemini)이 설정되지 않았습니다. API Key를 확인해주세요.", out), 0
+
+    tier = select_tier(difficulty, daily_free)
+    key = (school, str(grade), topic, difficulty, count, tier)
     try:
-        response = model.generate_content(system_prompt)
-        raw_text = response.text
+        problems = generation_cache.get_or_generate(key, username, lambda: _produce_problems(*key, daily_free=daily_free))
     except Exception as e:
-        return create_error_docx(f"AI 응답 오류: {str(e)}")
-    
-    # 여기서부터는 정상 생성 로직
+        return create_error_docx(f"AI 응답 오류: {str(e)}", out), 0
+
+    if not problems:
+        return create_error_docx("AI 응답에서 문제를 읽을 수 없습니다. 다시 시도해주세요.", out), 0
+    return build_docx(problems, topic, difficulty, is_commercial, out), len(problems)
+
+def build_docx(problems, topic, difficulty, is_commercial=False, out=None):
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    from docx.shared import Inches, RGBColor
     doc = Document()
     section = doc.sections[0]
     section.left_margin = Inches(0.5); section.right_margin = Inches(0.5)
@@ -204,27 +672,12 @@ def generate_math_docx(school, grade, topic, difficulty, count, is_commercial=Fa
 
     doc.add_paragraph("") 
     
-    items = raw_text.split('@@@')
+    count = len(problems)
     answers_list = []
     page_prob_count = 0
     
-    for idx, item in enumerate(items):
-        if idx >= count: break
-        if not item.strip(): continue
-        
-        lines = item.strip().split('\n')
-        mode = "TEXT"
-        temp_q, code_text, answer_text = [], "", ""
-        
-        for line in lines:
-            if "CODE_START" in line: mode = "CODE"
-            elif "CODE_END" in line: mode = "TEXT"
-            elif line.startswith("정답:"): answer_text = line.replace("정답:", "").strip()
-            else:
-                if mode == "CODE": code_text += line + "\n"
-                elif mode == "TEXT" and not line.startswith("문제"): temp_q.append(line)
-        
-        q_text = "\n".join(temp_q).strip()
+    for idx, prob in enumerate(problems):
+        answer_text = prob.answer or "(정답 누락)"
         answers_list.append(f"{idx+1}. {answer_text}")
         
         table = doc.add_table(rows=1, cols=2)
@@ -237,12 +690,17 @@ def generate_math_docx(school, grade, topic, difficulty, count, is_commercial=Fa
         run_num = p_num.add_run(f"{idx+1}. ")
         set_font(run_num, font_size=13, bold=True)
         
-        run_q = cell_q.add_paragraph().add_run(q_text)
+        run_q = cell_q.add_paragraph().add_run(prob.question)
         set_font(run_q, font_size=11)
         
-        if code_text.strip():
-            img_buf = create_plot_image(code_text)
-            if img_buf:
+        if prob.status != STATUS_OK:
+            run_warn = cell_q.add_paragraph().add_run("※ 이 문항은 AI 응답 형식 오류로 일부 내용이 누락되었을 수 있습니다.")
+            set_font(run_warn, font_size=8, color=RGBColor(200, 120, 0))
+        
+        if prob.figure or prob.code:
+            image = prob.image or render_figure(prob)[0]
+            if image:
+                img_buf = io.BytesIO(image)
                 p_img = cell_q.add_paragraph()
                 p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
                 p_img.add_run().add_picture(img_buf, width=Inches(3.5))
@@ -301,9 +759,59 @@ def generate_math_docx(school, grade, topic, difficulty, count, is_commercial=Fa
     set_font(run_ft, font_size=9, bold=True)
     add_page_number(run_ft)
 
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    return save_docx(doc, out)
+
+# -----------------------------------------------------------------------------
+# 11. 모델 등급 선택 및 사용량 기록
+# -----------------------------------------------------------------------------
+def select_tier(difficulty, daily_free=False):
+    tier = TIER_POLICY.get("daily_free") if daily_free else None
+    tier = tier or TIER_POLICY.get(difficulty) or TIER_POLICY["default"]
+    return tier if tier in models else TIER_POLICY["default"]
+
+def _generate(prompt, tier, shape, **kwargs):
+    started = time.perf_counter()
+    kwargs.setdefault("request_options", {"timeout": MODEL_TIMEOUT})
+    response = init_models().get(tier, model).generate_content(prompt, **kwargs)
+    usage_stats.record(tier, shape, time.perf_counter() - started, getattr(response, "usage_metadata", None))
+    return response
+
+class UsageStats:
+    """호출별 지연 시간과 토큰 수를 (모델 등급, 요청 모양) 단위로 기록"""
+
+    def __init__(self, max_samples=500):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = {}  # (tier, shape) -> [(지연 시간, 입력 토큰, 출력 토큰), ...]
+
+    def record(self, tier, shape, latency, usage):
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        with self._lock:
+            samples = self._samples.setdefault((tier, shape), [])
+            samples.append((latency, prompt_tokens, output_tokens))
+            if len(samples) > self.max_samples: del samples[0]
 
+    def report(self):
+        """등급/요청 모양별 p50 지연 시간, 출력 토큰당 지연, 토큰 수와 예상 비용"""
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._samples.items())
+        rows = []
+        for (tier, shape), samples in items:
+            latencies = [x[0] for x in samples]
+            prompt_tokens = sum(x[1] for x in samples)
+            output_tokens = sum(x[2] for x in samples)
+            in_price, out_price = TIER_PRICES.get(tier, (0, 0))
+            rows.append({
+                "등급": tier,
+                "요청": shape,
+                "호출 수": len(samples),
+                "p50 지연(초)": round(statistics.median(latencies), 2),
+                "p50 ms/출력토큰": round(statistics.median(x[0] * 1000 / x[2] for x in samples if x[2]) if output_tokens else 0, 1),
+                "입력 토큰": prompt_tokens,
+                "출력 토큰": output_tokens,
+                "예상 비용($)": round((prompt_tokens * in_price + output_tokens * out_price) / 1_000_000, 4),
+            })
+        return rows
 
+usage_stats = UsageStats()
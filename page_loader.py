@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# -----------------------------------------------------------------------------
+# 1. 공용 스레드 풀
+# -----------------------------------------------------------------------------
+# 화면 하나를 그릴 때 필요한 데이터를 동시에 가져옴 (페이지 지연 = 가장 느린 요청 하나)
+MAX_WORKERS = 16
+_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="page-loader")
+
+def _with_ctx(ctx, fn, *args):
+    # 작업 스레드에서도 st.session_state/st.secrets를 쓸 수 있도록 현재 세션 컨텍스트 연결
+    def run():
+        if ctx is not None: add_script_run_ctx(threading.current_thread(), ctx)
+        return fn(*args)
+    return run
+
+# -----------------------------------------------------------------------------
+# 2. 화면 단위 로더
+# -----------------------------------------------------------------------------
+class PageLoader:
+    """fetchers: 이름 -> fn(loader). 한 번 그리는 동안 같은 데이터/같은 시트는 한 번만 읽음"""
+
+    def __init__(self, fetchers):
+        self._fetchers = fetchers
+        self._ctx = get_script_run_ctx()
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._reads = {}
+
+    def _submit(self, name):
+        with self._lock:
+            future = self._futures.get(name)
+            if future is None:
+                future = self._futures[name] = _pool.submit(_with_ctx(self._ctx, self._fetchers[name], self))
+            return future
+
+    def prefetch(self, *names):
+        for name in names: self._submit(name)
+        return self
+
+    def get(self, name):
+        return self._submit(name).result()
+
+    def read_once(self, key, fn):
+        """여러 fetcher가 같은 워크시트를 읽어도 실제 요청은 한 번"""
+        # 풀 작업 안에서 다시 풀에 제출하면 풀이 가득 찼을 때 서로 기다릴 수 있으므로 처음 요청한 스레드가 직접 읽음
+        with self._lock:
+            future = self._reads.get(key)
+            owner = future is None
+            if owner: future = self._reads[key] = Future()
+        if owner:
+            try: future.set_result(fn())
+            except Exception as e: future.set_exception(e)
+        return future.result()
@@ -0,0 +1,167 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# -----------------------------------------------------------------------------
+# 1. 공유 상태 저장소 설정
+# -----------------------------------------------------------------------------
+# 같은 호스트의 여러 서버 프로세스가 같은 파일을 보면 결제 중복 처리/잔액 캐시/무료 사용 여부가 공유됨.
+# WAL 모드는 공유 메모리(-shm 파일)를 쓰므로 한 호스트의 로컬 디스크에서만 동작함:
+# NFS 등 네트워크 볼륨에 두면 잠금이 보장되지 않아 결제 중복 방지가 조용히 깨짐.
+# 여러 호스트로 늘릴 때는 이 모듈을 서버형 DB(예: PostgreSQL)로 바꿔야 함
+STATE_FILE = os.environ.get("GENIE_STATE_DB", ".genie_state.sqlite3")
+CREDIT_TTL = 300
+# 승인 요청(최대 약 33초)보다 길게. 이보다 오래된 PENDING은 세션이 중간에 끊긴 것으로 보고 다시 가져감
+PAYMENT_CLAIM_TTL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    payment_key TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS credits (
+    username TEXT PRIMARY KEY,
+    balance INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_free (
+    username TEXT NOT NULL,
+    day TEXT NOT NULL,
+    PRIMARY KEY (username, day)
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# PENDING(선점) -> CONFIRMED(토스 승인됨, 충전 전) -> CREDITED(이용권 충전 완료)
+PAYMENT_PENDING = "PENDING"
+PAYMENT_CONFIRMED = "CONFIRMED"
+PAYMENT_CREDITED = "CREDITED"
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+def configure(path):
+    global STATE_FILE
+    STATE_FILE = path
+
+def _conn():
+    # sqlite 연결은 스레드마다 따로 (Streamlit 세션은 각자 스레드에서 실행됨)
+    conns = getattr(_local, "conns", None)
+    if conns is None: conns = _local.conns = {}
+    conn = conns.get(STATE_FILE)
+    if conn is None:
+        conn = sqlite3.connect(STATE_FILE, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        with _init_lock:
+            if STATE_FILE not in _initialized:
+                conn.executescript(SCHEMA)
+                _initialized.add(STATE_FILE)
+        conns[STATE_FILE] = conn
+    return conn
+
+# -----------------------------------------------------------------------------
+# 2. 결제 중복 처리 방지
+# -----------------------------------------------------------------------------
+def claim_payment(payment_key, username, amount, stale_after=PAYMENT_CLAIM_TTL):
+    """처음 보는 paymentKey거나 선점 후 stale_after초 넘게 PENDING이면 선점하고 True.
+    처리 중이거나 이미 승인(CONFIRMED)/충전(CREDITED)된 키면 False.
+    PENDING은 아직 토스 승인 전이므로 이어받아 다시 승인해도 안전 (멱등키)"""
+    now = time.time()
+    conn = _conn()
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO payments (payment_key, username, amount, status, updated) VALUES (?, ?, ?, ?, ?)",
+        (payment_key, username, int(amount), PAYMENT_PENDING, now))
+    if cur.rowcount == 1: return True
+    # 선점한 세션이 승인/해제 전에 끊긴 경우 (예: 승인 중 새로고침) 한 세션만 이어받음
+    cur = conn.execute(
+        "UPDATE payments SET updated = ? WHERE payment_key = ? AND status = ? AND updated < ?",
+        (now, payment_key, PAYMENT_PENDING, now - stale_after))
+    return cur.rowcount == 1
+
+def confirm_payment(payment_key):
+    """토스 승인 직후, 충전 전에 호출. PENDING -> CONFIRMED로 바꾼 쪽만 True (그 세션만 충전)"""
+    cur = _conn().execute(
+        "UPDATE payments SET status = ?, updated = ? WHERE payment_key = ? AND status = ?",
+        (PAYMENT_CONFIRMED, time.time(), payment_key, PAYMENT_PENDING))
+    return cur.rowcount == 1
+
+def credit_payment(payment_key):
+    """이용권 충전이 시트에 기록된 뒤 호출"""
+    _conn().execute(
+        "UPDATE payments SET status = ?, updated = ? WHERE payment_key = ? AND status = ?",
+        (PAYMENT_CREDITED, time.time(), payment_key, PAYMENT_CONFIRMED))
+
+def release_payment(payment_key):
+    """승인 실패 시 선점 해제 (다시 시도할 수 있도록)"""
+    _conn().execute("DELETE FROM payments WHERE payment_key = ? AND status = ?", (payment_key, PAYMENT_PENDING))
+
+def payment_status(payment_key):
+    row = _conn().execute("SELECT status FROM payments WHERE payment_key = ?", (payment_key,)).fetchone()
+    return row[0] if row else None
+
+# -----------------------------------------------------------------------------
+# 3. 이용권 잔액 캐시 (시트 기록 후 바로 갱신하는 write-through)
+# -----------------------------------------------------------------------------
+def get_cached_credits(username, max_age=CREDIT_TTL):
+    row = _conn().execute("SELECT balance, updated FROM credits WHERE username = ?", (username,)).fetchone()
+    if not row: return None
+    if max_age is not None and time.time() - row[1] > max_age: return None
+    return row[0]
+
+def set_cached_credits(username, balance):
+    _conn().execute(
+        "INSERT INTO credits (username, balance, updated) VALUES (?, ?, ?) "
+        "ON CONFLICT(username) DO UPDATE SET balance = excluded.balance, updated = excluded.updated",
+        (username, int(balance), time.time()))
+
+def invalidate_credits(username):
+    _conn().execute("DELETE FROM credits WHERE username = ?", (username,))
+
+# -----------------------------------------------------------------------------
+# 4. 매일 무료 사용 여부
+# -----------------------------------------------------------------------------
+def mark_daily_free(username, day):
+    _conn().execute("INSERT OR IGNORE INTO daily_free (username, day) VALUES (?, ?)", (username, day))
+
+def daily_free_used(username, day):
+    return _conn().execute("SELECT 1 FROM daily_free WHERE username = ? AND day = ?", (username, day)).fetchone() is not None
+
+# -----------------------------------------------------------------------------
+# 5. 프로세스 간 작업 잠금 (시트 읽고-고쳐-쓰기 등 겹치면 안 되는 작업)
+# -----------------------------------------------------------------------------
+def acquire_lease(name, ttl=30):
+    """잡으면 토큰, 다른 곳에서 잡고 있으면 None. ttl초가 지나면 죽은 소유자의 잠금은 풀린 것으로 봄"""
+    token = uuid.uuid4().hex
+    now = time.time()
+    cur = _conn().execute(
+        "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires WHERE leases.expires < ?",
+        (name, token, now + ttl, now))
+    return token if cur.rowcount == 1 else None
+
+def release_lease(name, token):
+    _conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, token))
+
+@contextmanager
+def lease(name, ttl=30, wait=15):
+    """잡을 때까지 최대 wait초 기다림. 못 잡으면 TimeoutError"""
+    deadline = time.monotonic() + wait
+    token = acquire_lease(name, ttl)
+    while token is None:
+        if time.monotonic() >= deadline: raise TimeoutError(f"{name} 잠금을 얻지 못했습니다.")
+        time.sleep(0.05)
+        token = acquire_lease(name, ttl)
+    try: yield
+    finally: release_lease(name, token)
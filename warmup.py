@@ -0,0 +1,117 @@
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# -----------------------------------------------------------------------------
+# 1. 시작 시간 기록
+# -----------------------------------------------------------------------------
+# 새 서버 프로세스에서 첫 사용자가 폰트 캐시 생성, 교육과정 파일 읽기, 클라이언트 생성을
+# 대신 기다리지 않도록 로그인 화면을 그리는 동안 백그라운드에서 미리 처리
+BOOT_STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_thread = None
+_marks = {}     # 이름 -> 프로세스 시작 후 처음 도달한 시각(초)
+_timings = []   # (단계, 걸린 시간(초), 오류)
+_imports = {}   # 모듈 -> (처음 불러올 때 걸린 시간(초, 하위 모듈 포함), 불러온 단계)
+
+def mark(name):
+    """프로세스에서 처음 도달한 시점만 기록 (예: 모듈 불러오기 끝, 로그인 화면 표시)"""
+    with _lock:
+        _marks.setdefault(name, time.perf_counter() - BOOT_STARTED)
+
+# -----------------------------------------------------------------------------
+# 2. 모듈별 불러오기 시간
+# -----------------------------------------------------------------------------
+# 측정 중인 스레드에서 처음 불러오는 모듈만 기록 (python -X importtime의 누적 시간과 같은 기준).
+# 측정하는 곳이 하나도 없으면 원래 __import__로 되돌림
+_import_lock = threading.Lock()
+_profiling = threading.local()
+_original_import = None
+_active = 0
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    label = getattr(_profiling, "label", None)
+    if label is None or level or _profiling.depth or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    _profiling.depth += 1
+    started = time.perf_counter()
+    try: module = _original_import(name, globals, locals, fromlist, level)
+    finally: _profiling.depth -= 1
+    with _lock: _imports.setdefault(name, (time.perf_counter() - started, label))
+    return module
+
+def begin_import_profile(label):
+    global _original_import, _active
+    with _import_lock:
+        if _active == 0:
+            _original_import = builtins.__import__
+            builtins.__import__ = _timed_import
+        _active += 1
+    _profiling.label, _profiling.depth = label, 0
+
+def end_import_profile():
+    global _active
+    _profiling.label = None
+    with _import_lock:
+        _active -= 1
+        if _active == 0: builtins.__import__ = _original_import
+
+@contextmanager
+def import_profile(label):
+    begin_import_profile(label)
+    try: yield
+    finally: end_import_profile()
+
+_startup_profiled = False
+
+@contextmanager
+def startup_import_profile(label):
+    """앱 스크립트의 최상위 import용. 프로세스의 첫 실행에서만 측정 (이후 실행은 모두 sys.modules에 있어 기록할 것이 없음)"""
+    global _startup_profiled
+    with _lock:
+        first = not _startup_profiled
+        _startup_profiled = True
+    if not first:
+        yield
+        return
+    with import_profile(label): yield
+
+def import_report():
+    with _lock: items = sorted(_imports.items(), key=lambda item: -item[1][0])
+    return [{"모듈": name, "시간(ms)": round(took * 1000), "단계": label} for name, (took, label) in items]
+
+# -----------------------------------------------------------------------------
+# 3. 워밍업 스레드
+# -----------------------------------------------------------------------------
+def start(steps):
+    """steps: [(이름, fn), ...]. 프로세스당 한 번만 실행하고, 이미 시작했으면 False"""
+    global _thread
+    with _lock:
+        if _thread is not None: return False
+        _thread = threading.Thread(target=_run, args=(list(steps),), name="warmup", daemon=True)
+        _thread.start()
+    return True
+
+def _run(steps):
+    for name, fn in steps:
+        started = time.perf_counter()
+        error = None
+        try:
+            with import_profile(name): fn()
+        except Exception as e: error = f"{type(e).__name__}: {e}"
+        with _lock: _timings.append((name, time.perf_counter() - started, error))
+    mark("워밍업 완료")
+
+def done():
+    return _thread is not None and not _thread.is_alive()
+
+def report():
+    with _lock:
+        marks = sorted(_marks.items(), key=lambda item: item[1])
+        timings = list(_timings)
+    rows = [{"단계": name, "시간(ms)": round(at * 1000), "상태": "시작 후"} for name, at in marks]
+    rows += [{"단계": name, "시간(ms)": round(took * 1000), "상태": error or "완료"} for name, took, error in timings]
+    return rows